@@ -1,174 +1,411 @@
-from playwright.sync_api import Playwright, sync_playwright, BrowserContext, Page
+import asyncio
+import logging
+import os
+
+from playwright.async_api import Playwright, async_playwright, BrowserContext, Page
+
+from agent import jsonutil
+from agent.browser.dom import DOMElement
+
+# The tags and ARIA-role selectors the agent considers interactive. Plain
+# tags are collected in-page via getElementsByTagName (cheaper than a CSS
+# query); only the role selectors need querySelectorAll.
+INTERACTIVE_TAGS = ["a", "button", "input", "select", "textarea"]
+INTERACTIVE_ROLE_SELECTORS = ", ".join([
+    "[role='button']", "[role='link']", "[role='menuitem']", "[role='tab']",
+    "[role='checkbox']", "[role='radio']", "[role='option']",
+    "[role='combobox']", "[role='textbox']", "[role='searchbox']",
+])
+
+# The full joined query, kept for modules that want the exact set of
+# tags/roles the agent treats as interactive.
+INTERACTIVE_ELEMENT_SELECTORS = ", ".join(INTERACTIVE_TAGS) + ", " + INTERACTIVE_ROLE_SELECTORS
+
+# Installed once per context: counts DOM mutations so callers can tell
+# cheaply whether a page may have changed since the last observation,
+# without re-running the full extractor.
+MUTATION_COUNTER_JS = """(() => {
+    window.__agentMutations = 0;
+    const start = () => {
+        new MutationObserver(() => { window.__agentMutations += 1; })
+            .observe(document.documentElement,
+                     { subtree: true, childList: true, attributes: true, characterData: true });
+    };
+    if (document.documentElement) start();
+    else document.addEventListener('DOMContentLoaded', start, { once: true });
+})();"""
+
+# In-page extractor shared by the BrowserController and the browser pool: computes every per-element property inside the page and
+# returns the whole list as one JSON payload.
+DOM_EXTRACTOR_JS = """() => {
+    const tags = %s;
+    const roleSelectors = "%s";
+    const attrNames = ["id", "name", "aria-label", "data-testid", "placeholder", "title", "alt", "value", "href", "type", "role"];
+    const seen = new Set();
+    const elements = [];
+    for (const tag of tags) {
+        for (const el of document.getElementsByTagName(tag)) {
+            if (!seen.has(el)) { seen.add(el); elements.push(el); }
+        }
+    }
+    for (const el of document.querySelectorAll(roleSelectors)) {
+        if (!seen.has(el)) { seen.add(el); elements.push(el); }
+    }
+    // Restore document order, which the tag/role union loses.
+    elements.sort((a, b) => (a.compareDocumentPosition(b) & Node.DOCUMENT_POSITION_FOLLOWING) ? -1 : 1);
+    const results = [];
+    for (const el of elements) {
+        // Filter invisible/disabled elements here so they never cross the
+        // JS/Python boundary; they would be dropped on the other side anyway.
+        const rect = el.getBoundingClientRect();
+        const visible = rect.width > 0 && rect.height > 0 && getComputedStyle(el).visibility !== 'hidden';
+        if (!visible || el.disabled) {
+            continue;
+        }
+        const data = {
+            tag: el.tagName.toLowerCase(),
+            attributes: {},
+            text_content: (el.textContent || "").trim().slice(0, 200),
+            is_visible: true,
+            is_enabled: true,
+        };
+        for (const attr of attrNames) {
+            const value = el.getAttribute(attr);
+            if (value) {
+                data.attributes[attr] = value;
+            }
+        }
+        if (data.tag === 'select') {
+            data.options = Array.from(el.options).map(opt => ({
+                value: opt.getAttribute('value'),
+                text: (opt.textContent || "").trim(),
+            }));
+        }
+        results.push(data);
+    }
+    return JSON.stringify(results);
+}""" % (jsonutil.dumps(INTERACTIVE_TAGS), INTERACTIVE_ROLE_SELECTORS)
+
+
+# Derived selectors keyed by the identifying attributes that determine them.
+# The agent loop re-extracts the DOM every attempt and most elements survive
+# between attempts, so this avoids rebuilding the same strings each pass.
+_selector_cache: dict = {}
+_SELECTOR_CACHE_MAX = 4096
+
+
+def _derive_selector(tag: str, element_id: str, name: str, data_testid: str):
+    """Returns a selector for the element, preferring id, then name, then
+    data-testid, or None if no identifying attribute exists. Memoized."""
+    key = (tag, element_id, name, data_testid)
+    try:
+        return _selector_cache[key]
+    except KeyError:
+        pass
+
+    # This is a simplistic approach and might need refinement for complex pages
+    if element_id:
+        selector = f"#{element_id}"
+    elif name:
+        selector = f"{tag}[name='{name}']"
+    elif data_testid:
+        selector = f"[data-testid='{data_testid}']"
+    else:
+        selector = None
+
+    if len(_selector_cache) >= _SELECTOR_CACHE_MAX:
+        _selector_cache.clear()
+    _selector_cache[key] = selector
+    return selector
+
+
+def iter_simplified_elements(elements: list[dict]):
+    """Yields DOMElement instances from the raw DOM_EXTRACTOR_JS output,
+    deriving selectors and skipping invisible/disabled entries. Lazy, so
+    consumers that stop early (or filter further) never pay for the rest."""
+    for raw in elements:
+        # Visibility/enabled filtering happens in-page (DOM_EXTRACTOR_JS), so
+        # every raw entry that reaches us is already worth yielding.
+        element = DOMElement.from_raw(raw)
+        # If no identifying attribute exists, selector stays None and the AI
+        # decides based on the other attributes.
+        element.selector = _derive_selector(
+            element.tag, element.id, element.name, element.data_testid
+        )
+        yield element
+
+
+def simplify_extracted_elements(elements: list[dict]) -> list[DOMElement]:
+    """List-returning wrapper over iter_simplified_elements, for callers that
+    need truthiness checks and JSON serialization of the whole snapshot."""
+    return list(iter_simplified_elements(elements))
+
+
+# Resource types that never contribute to the simplified DOM the agent
+# observes. Blocking them at the network layer makes navigate() settle much
+# faster on media-heavy pages.
+BLOCKED_RESOURCE_TYPES = frozenset({"image", "font", "media"})
+
+# Flags for headless CI/server runs: skip GPU initialization and write shared
+# memory to /tmp instead of the often-tiny /dev/shm in containers.
+CHROMIUM_LAUNCH_ARGS = ["--disable-gpu", "--disable-dev-shm-usage"]
+
+logger = logging.getLogger(__name__)
+
 
 class BrowserController:
-    def __init__(self):
-        self.playwright: Playwright = sync_playwright().start()
-        self.browser: BrowserContext = self.playwright.chromium.launch(headless=False).new_context() # TODO: make headless configurable
-        self.page: Page = self.browser.new_page()
+    # Shared across all instances: starting Playwright and launching Chromium
+    # each take hundreds of ms, so pay that cost once per process. Each
+    # controller still gets its own isolated BrowserContext and Page.
+    _playwright: Playwright = None
+    _browser = None
+    # Serializes the shared launch: concurrent start() calls (run_many, the
+    # batch path in main) would otherwise each see _playwright as None and
+    # launch their own driver and Chromium, leaking all but the last.
+    _launch_lock = asyncio.Lock()
 
-    def navigate(self, url: str):
+    def __init__(self, block_resources: bool = True, headless: bool = True, storage_state_path: str = None):
+        # The async API cannot launch browsers from __init__; start() does the
+        # actual setup. headless only takes effect for the first controller,
+        # which launches the shared browser; pass headless=False there to
+        # watch a run.
+        self.block_resources = block_resources
+        self.headless = headless
+        # When set, the context starts from the storage state (cookies,
+        # localStorage) saved at this path and save_storage_state() writes
+        # back to it, so logins survive across runs and processes.
+        self.storage_state_path = storage_state_path
+        self.browser: BrowserContext = None
+        self.page: Page = None
+        # Locator objects are lazy (re-resolved on each action), so they can
+        # be cached and reused across calls for the same selector.
+        self._locator_cache: dict = {}
+
+    async def start(self):
+        """Launches (or reuses) the shared browser and opens this
+        controller's own context and page. Idempotent."""
+        if self.page is not None:
+            return
+        # _browser is assigned last, so it is the sentinel for the unlocked
+        # fast path: _playwright alone being set could mean another task is
+        # still mid-launch.
+        if BrowserController._browser is None:
+            async with BrowserController._launch_lock:
+                # Re-check under the lock: another controller may have
+                # finished the launch while this one waited.
+                if BrowserController._browser is None:
+                    if BrowserController._playwright is None:
+                        BrowserController._playwright = await async_playwright().start()
+                    BrowserController._browser = await BrowserController._playwright.chromium.launch(
+                        headless=self.headless, args=CHROMIUM_LAUNCH_ARGS
+                    )
+        storage_state = None
+        if self.storage_state_path and os.path.exists(self.storage_state_path):
+            storage_state = self.storage_state_path
+        self.browser = await BrowserController._browser.new_context(storage_state=storage_state)
+        await self.browser.add_init_script(MUTATION_COUNTER_JS)
+        self.page = await self.browser.new_page()
+        if self.block_resources:
+            await self.page.route("**/*", self._filter_heavy_resources)
+
+    @staticmethod
+    async def _filter_heavy_resources(route):
+        """Aborts requests for resource types the agent never inspects."""
+        if route.request.resource_type in BLOCKED_RESOURCE_TYPES:
+            await route.abort()
+        else:
+            await route.continue_()
+
+    def _locator(self, selector: str):
+        """Returns a cached Locator for the selector, creating it on first use."""
+        locator = self._locator_cache.get(selector)
+        if locator is None:
+            locator = self._locator_cache[selector] = self.page.locator(selector)
+        return locator
+
+    async def navigate(self, url: str):
         """Navigates to the given URL."""
+        self._locator_cache.clear()
         try:
-            self.page.goto(url, wait_until="domcontentloaded") # Consider 'load' or 'networkidle' based on needs
+            await self.page.goto(url, wait_until="domcontentloaded") # Consider 'load' or 'networkidle' based on needs
         except Exception as e:
-            print(f"Error navigating to {url}: {e}")
+            logger.error("Error navigating to %s: %s", url, e)
             # Potentially raise a custom exception or handle more gracefully
 
-    def shutdown(self):
-        """Closes the browser and cleans up Playwright resources."""
-        if hasattr(self, 'page') and self.page:
-            self.page.close()
-        if hasattr(self, 'browser') and self.browser:
-            self.browser.close()
-        if hasattr(self, 'playwright') and self.playwright:
-            self.playwright.stop()
-        print("Browser shutdown complete.")
-
-    def click_element(self, selector: str):
+    async def reset(self):
+        """Returns the context to a clean, reusable state (no cookies, blank
+        page) without closing it, so the next run skips context/page setup."""
+        if self.page is None:
+            return
+        self._locator_cache.clear()
+        try:
+            await self.browser.clear_cookies()
+            await self.page.goto("about:blank")
+        except Exception as e:
+            logger.warning("Error resetting context: %s", e)
+
+    async def get_mutation_token(self):
+        """
+        Returns an opaque token that changes whenever the page may have
+        changed: the current URL plus the in-page mutation counter. Returns
+        None (meaning "assume changed") if the counter is unavailable.
+        """
+        try:
+            count = await self.page.evaluate("window.__agentMutations || 0")
+        except Exception:
+            return None
+        return (self.page.url, count)
+
+    async def save_storage_state(self):
+        """Persists the context's cookies and localStorage to
+        storage_state_path, if one was configured."""
+        if self.storage_state_path and self.browser:
+            try:
+                await self.browser.storage_state(path=self.storage_state_path)
+            except Exception as e:
+                logger.warning("Error saving storage state: %s", e)
+
+    async def shutdown(self):
+        """Closes this controller's page and context.
+
+        The shared browser process and Playwright driver stay up so that
+        later controllers start instantly; call shutdown_all() to tear
+        those down at process exit.
+        """
+        if self.page:
+            await self.page.close()
+            self.page = None
+        if self.browser:
+            await self.browser.close()
+            self.browser = None
+        logger.info("Browser shutdown complete.")
+
+    @classmethod
+    async def shutdown_all(cls):
+        """Stops the shared browser process and Playwright driver."""
+        if cls._browser:
+            await cls._browser.close()
+            cls._browser = None
+        if cls._playwright:
+            await cls._playwright.stop()
+            cls._playwright = None
+
+    async def click_element(self, selector: str):
         """Clicks the element specified by the selector."""
         try:
-            self.page.locator(selector).click()
-            print(f"Clicked element with selector: {selector}")
+            await self._locator(selector).click()
+            logger.debug("Clicked element with selector: %s", selector)
         except Exception as e:
-            print(f"Error clicking element {selector}: {e}")
+            logger.warning("Error clicking element %s: %s", selector, e)
             # Handle error (e.g., element not found, not clickable)
 
-    def type_in_element(self, selector: str, text: str):
+    async def type_in_element(self, selector: str, text: str):
         """Types the given text into the element specified by the selector."""
         try:
-            self.page.locator(selector).fill(text)
-            print(f"Typed '{text}' into element with selector: {selector}")
+            await self._locator(selector).fill(text)
+            logger.debug("Typed %r into element with selector: %s", text, selector)
         except Exception as e:
-            print(f"Error typing into element {selector}: {e}")
+            logger.warning("Error typing into element %s: %s", selector, e)
             # Handle error
 
-    def select_option(self, selector: str, value: str):
+    async def select_option(self, selector: str, value: str):
         """Selects an option by its value in a select element."""
         try:
-            self.page.locator(selector).select_option(value)
-            print(f"Selected option '{value}' in element with selector: {selector}")
+            await self._locator(selector).select_option(value)
+            logger.debug("Selected option %r in element with selector: %s", value, selector)
         except Exception as e:
-            print(f"Error selecting option in element {selector}: {e}")
+            logger.warning("Error selecting option in element %s: %s", selector, e)
             # Handle error (e.g., option not found)
 
-    def get_simplified_dom(self) -> list[dict]:
+    async def wait_for_ready(self, timeout_ms: int = 2000):
         """
-        Extracts all interactive elements (a, button, input, select, textarea)
-        from the current page and returns a simplified list of dictionaries.
+        Waits until the page has settled after an action, returning as soon as
+        the network goes idle (or immediately if it already is) instead of
+        sleeping a fixed interval. timeout_ms is a ceiling, not a floor: slow
+        pages stop waiting after it, fast pages barely wait at all.
+        """
+        try:
+            await self.page.wait_for_load_state("networkidle", timeout=timeout_ms)
+        except Exception:
+            # Busy pages (long-polling, analytics) may never go network-idle;
+            # settle for the document being fully parsed.
+            try:
+                await self.page.wait_for_function("document.readyState === 'complete'", timeout=timeout_ms)
+            except Exception:
+                logger.debug("Page did not settle within %sms; continuing.", timeout_ms)
+
+    async def wait_for_body(self, timeout_ms: int = 1000):
+        """Waits for a <body> element to exist (e.g. before retrying an empty
+        DOM extraction), bounded by timeout_ms."""
+        try:
+            await self.page.wait_for_selector("body", timeout=timeout_ms)
+        except Exception:
+            logger.debug("No <body> within %sms.", timeout_ms)
+
+    async def selector_exists(self, selector: str) -> bool:
+        """Returns True if the selector matches at least one element. Much
+        cheaper than a full get_simplified_dom when only one selector needs
+        checking (e.g. when replaying a previously successful action)."""
+        try:
+            return await self._locator(selector).count() > 0
+        except Exception as e:
+            logger.warning("Error checking selector %s: %s", selector, e)
+            return False
+
+    async def get_simplified_dom(self) -> list[DOMElement]:
         """
-        interactive_elements_data = []
-        selectors = "a, button, input, select, textarea, [role='button'], [role='link'], [role='menuitem'], [role='tab'], [role='checkbox'], [role='radio'], [role='option'], [role='combobox'], [role='textbox'], [role='searchbox']"
+        Extracts all interactive elements (a, button, input, select, textarea)
+        from the current page and returns a simplified list of DOMElements.
 
+        The whole extraction runs as ONE page.evaluate call: the per-element
+        properties (tag, attributes, text, visibility, enabled state, select
+        options) are computed in-page by a single JS function and returned as
+        one JSON payload. The previous implementation made ~15 CDP round-trips
+        per element, which dominated latency on element-heavy pages.
+        """
         try:
-            elements = self.page.query_selector_all(selectors)
-            for element in elements:
-                # Basic properties
-                element_data = {
-                    "tag": element.evaluate("el => el.tagName.toLowerCase()"),
-                    "attributes": {},
-                    "text_content": (element.text_content() or "").strip()[:200], # Limit text length
-                    "is_visible": element.is_visible(),
-                    "is_enabled": element.is_enabled(),
-                }
-
-                # Extract common identifying attributes
-                for attr in ["id", "name", "aria-label", "data-testid", "placeholder", "title", "alt", "value", "href", "type", "role"]:
-                    attr_value = element.get_attribute(attr)
-                    if attr_value:
-                        element_data["attributes"][attr] = attr_value
-
-                # For input elements, get the type
-                if element_data["tag"] == "input":
-                    input_type = element.get_attribute("type")
-                    if input_type:
-                         element_data["attributes"]["type"] = input_type
-
-                # For select elements, get options
-                if element_data["tag"] == "select":
-                    options = element.query_selector_all("option")
-                    element_data["options"] = []
-                    for opt in options:
-                        opt_value = opt.get_attribute("value")
-                        opt_text = (opt.text_content() or "").strip()
-                        element_data["options"].append({"value": opt_value, "text": opt_text})
-
-                # Generate a unique selector if possible (preferring id, then name, then data-testid)
-                # This is a simplistic approach and might need refinement for complex pages
-                unique_id = element.get_attribute("id")
-                if unique_id:
-                    element_data["selector"] = f"#{unique_id}"
-                else:
-                    name = element.get_attribute("name")
-                    if name:
-                        element_data["selector"] = f"[{element_data['tag']}[name='{name}']" # More specific
-                    else:
-                        data_testid = element.get_attribute("data-testid")
-                        if data_testid:
-                            element_data["selector"] = f"[data-testid='{data_testid}']"
-                        else:
-                            # Fallback to a less ideal selector, could be brittle
-                            # For now, we'll let the AI decide based on the attributes
-                            pass
-
-
-                # Only add if it's visible and enabled, to reduce noise for the LLM
-                if element_data["is_visible"] and element_data["is_enabled"]:
-                    interactive_elements_data.append(element_data)
-
-            return interactive_elements_data
+            elements = jsonutil.loads(await self.page.evaluate(DOM_EXTRACTOR_JS))
+            return simplify_extracted_elements(elements)
 
         except Exception as e:
-            print(f"Error getting simplified DOM: {e}")
+            logger.error("Error getting simplified DOM: %s", e)
             return [] # Return empty list on error
 
 if __name__ == '__main__':
     # Example Usage (for testing purposes)
-    controller = BrowserController()
-    controller.navigate("https://www.google.com")
-
-    # Test typing in search bar
-    # First, let's inspect the DOM to find a selector for the search bar
-    simplified_dom_before_search = controller.get_simplified_dom()
-    print("\\nSimplified DOM (Google):")
-    for el in simplified_dom_before_search:
-        if el['attributes'].get('name') == 'q' or 'search' in (el['attributes'].get('aria-label') or '').lower():
-            print(el) # Print potential search bar elements
-            # Found it: {'tag': 'textarea', 'attributes': {'aria-label': 'Search', 'name': 'q', ...}, ...}
-            # So, selector could be "textarea[name='q']" or "[aria-label='Search']"
-
-    # controller.type_in_element("textarea[name='q']", "Playwright browser automation") # Using name
-    # Or using aria-label which might be more stable for some sites
-    controller.type_in_element("[aria-label='Search']", "Playwright browser automation")
-
-
-    # Test clicking the search button
-    # Inspect DOM again or use prior knowledge. Google's search button often has input type submit and a name like 'btnK' or an aria-label
-    # simplified_dom_after_typing = controller.get_simplified_dom()
-    # print("\\nSimplified DOM (after typing):")
-    # for el in simplified_dom_after_typing:
-    #    if el['tag'] == 'input' and el['attributes'].get('type') == 'submit' and 'search' in (el['attributes'].get('aria-label') or '').lower() :
-    #        print(el)
-            # Found: {'tag': 'input', 'attributes': {'aria-label': 'Google Search', 'name': 'btnK', 'type': 'submit', ... }
-            # Selector: "input[name='btnK']" or "[aria-label='Google Search']"
-
-    # Give some time for the button to potentially appear or become active after typing
-    controller.page.wait_for_timeout(1000) # wait 1 second
-
-    # Click the search button (try a common selector for Google search button)
-    # This might require careful selector choice, Google's page can be complex.
-    # Using a selector that is generally visible and associated with search.
-    # controller.click_element("input[name='btnK']") # This selector targets one of the search buttons
-    # Trying a more general approach if the specific name isn't always there or if there are multiple.
-    # Let's try clicking the one that has "Google Search" as aria-label
-    controller.click_element("input[aria-label='Google Search']")
-
-
-    controller.page.wait_for_timeout(3000) # Wait for search results to load
-
-    print("\\nSimplified DOM (Search Results for Playwright):")
-    simplified_dom_results = controller.get_simplified_dom()
-    for i, el in enumerate(simplified_dom_results):
-        if i < 15: # Print first 15 interactive elements
-            print(el)
-
-    controller.shutdown()
+    import asyncio
+
+    async def _demo():
+        controller = BrowserController()
+        await controller.start()
+        await controller.navigate("https://www.google.com")
+
+        # Test typing in search bar
+        # First, let's inspect the DOM to find a selector for the search bar
+        simplified_dom_before_search = await controller.get_simplified_dom()
+        print("\\nSimplified DOM (Google):")
+        for el in simplified_dom_before_search:
+            if el.name == 'q' or 'search' in (el.aria_label or '').lower():
+                print(el) # Print potential search bar elements
+                # So, selector could be "textarea[name='q']" or "[aria-label='Search']"
+
+        # Using aria-label which might be more stable for some sites
+        await controller.type_in_element("[aria-label='Search']", "Playwright browser automation")
+
+        # Locator auto-waiting handles the button appearing/becoming active
+        # after typing, so no fixed sleep is needed before the click.
+        await controller.click_element("input[aria-label='Google Search']")
+
+        await controller.page.wait_for_load_state("domcontentloaded") # Wait for search results to load
+
+        print("\\nSimplified DOM (Search Results for Playwright):")
+        simplified_dom_results = await controller.get_simplified_dom()
+        for i, el in enumerate(simplified_dom_results):
+            if i < 15: # Print first 15 interactive elements
+                print(el)
+
+        await controller.shutdown()
+        await BrowserController.shutdown_all()
+
+    logging.basicConfig(level=logging.DEBUG)
+    asyncio.run(_demo())
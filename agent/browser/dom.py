@@ -0,0 +1,97 @@
+import sys
+from dataclasses import dataclass
+
+# HTML attribute name -> DOMElement field name, for the identifying
+# attributes the extractor collects.
+_ATTR_FIELDS = {
+    "id": "id",
+    "name": "name",
+    "aria-label": "aria_label",
+    "data-testid": "data_testid",
+    "placeholder": "placeholder",
+    "title": "title",
+    "alt": "alt",
+    "value": "value",
+    "href": "href",
+    "type": "type",
+    "role": "role",
+}
+
+
+@dataclass(slots=True)
+class DOMElement:
+    """
+    One interactive element from a simplified-DOM snapshot.
+
+    Flat, __slots__-backed replacement for the nested per-element dicts the
+    extractor used to return: each identifying attribute is its own field,
+    so a 500-element snapshot is hundreds of small fixed-layout objects
+    instead of dicts-of-dicts, with cheaper attribute access in the hot
+    filtering/serialization paths.
+    """
+    tag: str
+    text_content: str = ""
+    is_visible: bool = False
+    is_enabled: bool = False
+    selector: str = None
+    options: list = None
+    id: str = None
+    name: str = None
+    aria_label: str = None
+    data_testid: str = None
+    placeholder: str = None
+    title: str = None
+    alt: str = None
+    value: str = None
+    href: str = None
+    type: str = None
+    role: str = None
+
+    @classmethod
+    def from_raw(cls, raw: dict) -> "DOMElement":
+        """Builds a DOMElement from one raw DOM_EXTRACTOR_JS entry."""
+        attributes = raw.get("attributes", {})
+        kwargs = {
+            field: attributes[attr]
+            for attr, field in _ATTR_FIELDS.items()
+            if attributes.get(attr)
+        }
+        # Intern the highly repetitive strings: a snapshot holds a handful of
+        # distinct tag/type/role values repeated across hundreds of elements,
+        # so interning makes them shared singletons with O(1) comparisons.
+        for field in ("type", "role"):
+            if field in kwargs:
+                kwargs[field] = sys.intern(kwargs[field])
+        return cls(
+            tag=sys.intern(raw["tag"]),
+            text_content=raw.get("text_content", ""),
+            is_visible=raw.get("is_visible", False),
+            is_enabled=raw.get("is_enabled", False),
+            options=raw.get("options"),
+            **kwargs,
+        )
+
+    @property
+    def attributes(self) -> dict:
+        """The element's identifying attributes as an HTML-named dict
+        (e.g. 'aria-label'), containing only the attributes present."""
+        return {
+            attr: value
+            for attr, field in _ATTR_FIELDS.items()
+            if (value := getattr(self, field))
+        }
+
+    def to_dict(self) -> dict:
+        """Serializes to the nested dict shape used in prompts and reports."""
+        data = {
+            "tag": self.tag,
+            "attributes": self.attributes,
+            "text_content": self.text_content,
+            "is_visible": self.is_visible,
+            "is_enabled": self.is_enabled,
+        }
+        if self.selector:
+            data["selector"] = self.selector
+        if self.options is not None:
+            data["options"] = self.options
+        return data
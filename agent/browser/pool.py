@@ -0,0 +1,80 @@
+import asyncio
+import logging
+
+from playwright.async_api import async_playwright
+
+from agent import jsonutil
+from agent.browser.controller import DOM_EXTRACTOR_JS, simplify_extracted_elements
+from agent.browser.dom import DOMElement
+
+logger = logging.getLogger(__name__)
+
+class AsyncBrowserPool:
+    """
+    Async Playwright pool for running multiple page extractions concurrently.
+
+    One Playwright driver and one browser process are shared; each extraction
+    gets its own short-lived BrowserContext. A semaphore caps how many pages
+    are in flight at once so a large batch of URLs doesn't exhaust memory or
+    file descriptors. Intended for batch DOM-extraction workloads; the
+    interactive agent loop uses BrowserController, whose contexts carry
+    per-run state (storage, routing, mutation counter) this pool does not.
+    """
+    def __init__(self, max_concurrency: int = 4, headless: bool = True):
+        self.max_concurrency = max_concurrency
+        self.headless = headless
+        self._playwright = None
+        self._browser = None
+        self._semaphore = None
+
+    async def start(self):
+        """Starts the shared Playwright driver and browser process."""
+        self._playwright = await async_playwright().start()
+        self._browser = await self._playwright.chromium.launch(headless=self.headless)
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+
+    async def stop(self):
+        """Closes the shared browser and stops the Playwright driver."""
+        if self._browser:
+            await self._browser.close()
+            self._browser = None
+        if self._playwright:
+            await self._playwright.stop()
+            self._playwright = None
+
+    async def get_simplified_dom(self, url: str) -> list[DOMElement]:
+        """
+        Navigates a fresh context to the URL and returns its simplified DOM.
+        Concurrency is bounded by the pool's semaphore.
+        """
+        async with self._semaphore:
+            context = await self._browser.new_context()
+            try:
+                page = await context.new_page()
+                await page.goto(url, wait_until="domcontentloaded")
+                elements = jsonutil.loads(await page.evaluate(DOM_EXTRACTOR_JS))
+                return simplify_extracted_elements(elements)
+            except Exception as e:
+                logger.error("Error extracting DOM from %s: %s", url, e)
+                return []
+            finally:
+                await context.close()
+
+    async def get_simplified_doms(self, urls: list[str]) -> list[list[DOMElement]]:
+        """Extracts simplified DOMs for many URLs concurrently."""
+        return await asyncio.gather(*(self.get_simplified_dom(url) for url in urls))
+
+if __name__ == '__main__':
+    # Example Usage (for testing purposes)
+    async def _demo():
+        pool = AsyncBrowserPool(max_concurrency=2)
+        await pool.start()
+        doms = await pool.get_simplified_doms([
+            "https://www.example.com",
+            "https://www.example.org",
+        ])
+        for url_dom in doms:
+            print(f"Extracted {len(url_dom)} interactive elements.")
+        await pool.stop()
+
+    asyncio.run(_demo())
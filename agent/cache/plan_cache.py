@@ -0,0 +1,74 @@
+"""
+Disk-backed cache for plans and action sequences.
+
+The in-process caches in the orchestrator die with the process, so a
+fresh CLI invocation re-pays the full planning cost even for an
+objective that succeeded minutes earlier. This module persists small
+JSON values under ~/.cache/ai-agent/<namespace>/, keyed by a SHA-256
+fingerprint, with atomic writes (temp file + os.replace) so concurrent
+runs never observe a torn file. Entries expire after TTL_SECONDS;
+lookups never raise — a missing, expired, or corrupt entry is simply a
+miss.
+"""
+import hashlib
+import os
+import tempfile
+import time
+
+from agent import jsonutil
+
+CACHE_ROOT = os.path.join(os.path.expanduser("~"), ".cache", "ai-agent")
+
+# Cached plans describe page structure, which drifts; a week keeps warm
+# repeat runs fast without replaying against long-stale assumptions.
+TTL_SECONDS = 7 * 24 * 3600
+
+
+def fingerprint(*parts: str) -> str:
+    """SHA-256 key over the given string parts."""
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(part.encode("utf-8"))
+        digest.update(b"\x00")
+    return digest.hexdigest()
+
+
+def _path(namespace: str, key: str) -> str:
+    return os.path.join(CACHE_ROOT, namespace, key + ".json")
+
+
+def get(namespace: str, key: str):
+    """Returns the cached value, or None on miss/expiry/corruption."""
+    path = _path(namespace, key)
+    try:
+        if time.time() - os.path.getmtime(path) > TTL_SECONDS:
+            return None
+        with open(path, "rb") as f:
+            return jsonutil.loads(f.read())
+    except (OSError, ValueError):
+        return None
+
+
+def put(namespace: str, key: str, value) -> None:
+    """Atomically writes the value; failures are swallowed (cache only)."""
+    directory = os.path.join(CACHE_ROOT, namespace)
+    try:
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                f.write(jsonutil.dumps(value))
+            os.replace(tmp, _path(namespace, key))
+        except BaseException:
+            os.unlink(tmp)
+            raise
+    except OSError:
+        pass
+
+
+def invalidate(namespace: str, key: str) -> None:
+    """Removes an entry, e.g. after a cached plan failed to replay."""
+    try:
+        os.remove(_path(namespace, key))
+    except OSError:
+        pass
@@ -0,0 +1,60 @@
+"""
+Compaction pass over simplified-DOM snapshots.
+
+Grid and listing pages produce long runs of near-identical elements
+(table rows, product cards, pagination links) that differ only in a
+number or an id suffix. Sending each one to the model in full detail
+multiplies prompt tokens without adding information, so compact()
+collapses such runs into one representative element annotated with the
+run length. Elements that carry a derived selector are never collapsed:
+each is an individually addressable action target the model may need.
+"""
+import re
+from dataclasses import replace
+
+from agent.browser.dom import DOMElement
+
+_NUMBER_RE = re.compile(r"\d+")
+
+# Runs shorter than this are left alone; collapsing a pair saves little
+# and loses the second element's exact text.
+_MIN_RUN = 3
+
+
+def _text_template(text: str) -> str:
+    """Replaces digit runs with a {i} placeholder, so 'Row 17' and
+    'Row 18' share a template."""
+    return _NUMBER_RE.sub("{i}", text)
+
+
+def _run_signature(el: DOMElement) -> tuple:
+    """Elements with equal signatures are interchangeable for planning."""
+    return (el.tag, el.type, el.role, el.href and _text_template(el.href),
+            _text_template(el.text_content[:80]))
+
+
+def compact(dom: list[DOMElement]) -> list[DOMElement]:
+    """
+    Returns the snapshot with runs of at least _MIN_RUN consecutive
+    selector-less near-duplicates replaced by their first element, its
+    text rewritten to the shared template plus a '(xN similar)' marker.
+    The returned list aliases the original elements except for the
+    representatives, which are copies.
+    """
+    out: list[DOMElement] = []
+    i, n = 0, len(dom)
+    while i < n:
+        el = dom[i]
+        if el.selector is None:
+            signature = _run_signature(el)
+            j = i + 1
+            while j < n and dom[j].selector is None and _run_signature(dom[j]) == signature:
+                j += 1
+            if j - i >= _MIN_RUN:
+                template = _text_template(el.text_content)
+                out.append(replace(el, text_content=f"{template} (x{j - i} similar)"))
+                i = j
+                continue
+        out.append(el)
+        i += 1
+    return out
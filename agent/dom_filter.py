@@ -0,0 +1,95 @@
+"""
+Relevance filtering of simplified-DOM snapshots before prompting.
+
+Content-heavy pages can expose many hundreds of interactive elements,
+and the DOM section dominates per-attempt prompt tokens. filter_dom()
+ranks elements against the objective with a small pure-Python BM25 over
+each element's tag/attribute/text terms, adds a per-role interactivity
+prior (buttons and inputs outrank plain links), and keeps only the
+top-ranked elements within an element and approximate-token budget —
+in original document order, so the model still sees page structure.
+Snapshots already within budget pass through untouched.
+"""
+import math
+import re
+
+from agent.browser.dom import DOMElement
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+# BM25 constants (standard defaults).
+_K1 = 1.5
+_B = 0.75
+
+# Interactivity prior added to the relevance score, by ARIA role first
+# and tag as fallback. Elements the agent most often needs to act on
+# rank above decorative links even when the objective terms miss them.
+_PRIORITY_BY_ROLE = {
+    "button": 100, "textbox": 95, "searchbox": 95, "combobox": 90,
+    "checkbox": 85, "radio": 85, "option": 75, "menuitem": 70,
+    "tab": 70, "link": 60,
+}
+_PRIORITY_BY_TAG = {
+    "button": 100, "input": 95, "select": 90, "textarea": 90, "a": 60,
+}
+
+
+def _terms(element: DOMElement) -> list[str]:
+    parts = [element.tag, element.text_content]
+    parts.extend(element.attributes.values())
+    return _TOKEN_RE.findall(" ".join(parts).lower())
+
+
+def _token_cost(element: DOMElement) -> int:
+    """Rough prompt-token cost of one element (chars / 4 heuristic)."""
+    chars = len(element.text_content) + sum(len(v) for v in element.attributes.values()) + 40
+    return chars // 4
+
+
+def filter_dom(dom: list[DOMElement], objective: str,
+               max_elements: int = 300, max_tokens: int = 8000) -> list[DOMElement]:
+    """
+    Returns the snapshot reduced to the elements most relevant to the
+    objective, within both budgets, preserving document order. The full
+    snapshot is returned unchanged when it already fits.
+    """
+    if len(dom) <= max_elements and sum(_token_cost(el) for el in dom) <= max_tokens:
+        return dom
+
+    query = _TOKEN_RE.findall(objective.lower())
+    docs = [_terms(el) for el in dom]
+    avgdl = sum(len(d) for d in docs) / len(docs)
+    df: dict[str, int] = {}
+    for doc in docs:
+        for term in set(doc):
+            df[term] = df.get(term, 0) + 1
+    n = len(docs)
+
+    scored = []
+    for index, (element, doc) in enumerate(zip(dom, docs)):
+        score = 0.0
+        if query and doc:
+            counts: dict[str, int] = {}
+            for term in doc:
+                counts[term] = counts.get(term, 0) + 1
+            for term in query:
+                tf = counts.get(term)
+                if not tf:
+                    continue
+                idf = math.log(1 + (n - df[term] + 0.5) / (df[term] + 0.5))
+                score += idf * tf * (_K1 + 1) / (tf + _K1 * (1 - _B + _B * len(doc) / avgdl))
+        score += _PRIORITY_BY_ROLE.get(element.role) or _PRIORITY_BY_TAG.get(element.tag, 0)
+        scored.append((score, index, element))
+
+    scored.sort(key=lambda item: item[0], reverse=True)
+    kept: list[tuple[int, DOMElement]] = []
+    budget = max_tokens
+    for score, index, element in scored[:max_elements]:
+        cost = _token_cost(element)
+        if cost > budget:
+            continue
+        budget -= cost
+        kept.append((index, element))
+
+    kept.sort()
+    return [element for _, element in kept]
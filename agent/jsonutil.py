@@ -0,0 +1,31 @@
+"""
+JSON helpers shared across the agent.
+
+Uses orjson when it is installed — parsing the multi-hundred-element DOM
+payload and serializing prompts/reports are hot paths, and orjson is a
+compiled implementation several times faster than the stdlib — and falls
+back to the stdlib json module so orjson stays an optional dependency.
+"""
+
+try:
+    import orjson
+
+    def loads(data):
+        """Parses a JSON str/bytes payload."""
+        return orjson.loads(data)
+
+    def dumps(obj, indent: bool = False) -> str:
+        """Serializes obj to a JSON string (2-space indent when indent=True)."""
+        option = orjson.OPT_INDENT_2 if indent else 0
+        return orjson.dumps(obj, option=option).decode("utf-8")
+
+except ImportError:
+    import json
+
+    def loads(data):
+        """Parses a JSON str/bytes payload."""
+        return json.loads(data)
+
+    def dumps(obj, indent: bool = False) -> str:
+        """Serializes obj to a JSON string (2-space indent when indent=True)."""
+        return json.dumps(obj, indent=2 if indent else None, ensure_ascii=False)
@@ -1,61 +1,597 @@
-import time
+import asyncio
+import hashlib
+import logging
+import re
+
+from agent import dom_compact
+from agent import dom_filter
+from agent.cache import plan_cache
 from agent.browser.controller import BrowserController
+from agent.orchestrator_types import ActionRecord
 from agent.providers.base import AIProvider
 
+logger = logging.getLogger(__name__)
+
+
+class _RecordingHistory(list):
+    """
+    History list that mirrors every appended record to a caller-supplied
+    sink, letting run_test callers stream records (e.g. into a report
+    file) as they happen instead of serializing the whole list at the
+    end. A failing sink is logged and dropped rather than killing the run.
+    """
+    def __init__(self, sink):
+        super().__init__()
+        self._sink = sink
+
+    def append(self, record):
+        super().append(record)
+        if self._sink is not None:
+            try:
+                self._sink(record)
+            except Exception:
+                logger.warning("record_sink raised; disabling record streaming.", exc_info=True)
+                self._sink = None
+
+
 class Orchestrator:
-    def __init__(self, provider: AIProvider, max_attempts=10):
+    # Replay-style skill cache: successful action sequences keyed by
+    # (objective, start_url). A repeated run replays the known-good actions —
+    # one cheap selector check per step — and only falls back to the full
+    # observe/plan loop (DOM extraction + LLM call per step) if the page has
+    # drifted and a cached selector no longer matches.
+    _skill_cache: dict = {}
+
+    def __init__(self, provider: AIProvider, max_attempts=10, settle_timeout_ms=2000, plan_depth=3, persistent=True, verbose=False, max_consecutive_errors=3, history_window=8, storage_state_path=None):
         self.ai_provider = provider
-        self.browser_controller = BrowserController()
+        self.browser_controller = BrowserController(storage_state_path=storage_state_path)
         self.max_attempts = max_attempts
+        # A run that keeps erroring is aborted after this many consecutive
+        # error attempts instead of burning the rest of max_attempts on LLM
+        # and browser round-trips that are unlikely to recover.
+        self.max_consecutive_errors = max_consecutive_errors
+        # Only the last history_window entries go to the LLM verbatim; older
+        # ones are folded into a one-line summary, keeping the prompt size
+        # constant instead of growing with the attempt index.
+        self.history_window = history_window
+        self._history_summary = None
+        self._summarized_len = 0
+        # When persistent, run_test leaves the browser context warm (reset to
+        # a blank page) so back-to-back runs skip context/page setup; call
+        # shutdown() explicitly when done. When False, every run tears its
+        # context down as before.
+        self.persistent = persistent
+        # Ceiling for the post-action settle wait; 0 disables waiting (tests).
+        self.settle_timeout_ms = settle_timeout_ms
+        # How many actions to request per LLM call, and the queue of planned
+        # actions not yet executed. One call amortizes over up to plan_depth
+        # steps; the queue is flushed whenever a step fails or the page no
+        # longer matches what the plan assumed.
+        self.plan_depth = plan_depth
+        self.plan_queue: list[dict] = []
+        # Pipeline parallelism: while the browser executes an action and the
+        # page settles, the next LLM plan can already be in flight as a task.
+        # history is only ever mutated on the main task; the speculative call
+        # gets its own snapshot.
+        self._speculative = None  # (task, pre-action DOM fingerprint)
+        # Response-cache over planning: fingerprint of the previous attempt's
+        # DOM (to detect no-op actions) and plans keyed by (objective, fp) so
+        # a recurring page state doesn't pay a second identical LLM call.
+        self._last_fp = None
+        self._plan_cache: dict = {}
+        # Disk key of the plan currently being executed, when it is backed by
+        # the on-disk memo; an erroring action evicts that entry (the page
+        # drifted from the state the memo was recorded against).
+        self._active_plan_key = None
+        # Snapshot of the DOM last shown to the provider in full, so the next
+        # planning call can send only the delta (providers fall back to the
+        # full DOM when the page changed too much for a delta to pay off).
+        self._prev_sent_dom = None
+        # Last DOM snapshot and the page mutation token it was taken at; when
+        # the token is unchanged the snapshot is reused instead of re-running
+        # the in-page extractor.
+        self._last_dom = None
+        self._last_mutation_token = None
+        # Selectors present in the most recently observed DOM; used to reject
+        # hallucinated selectors in memory before paying a browser call.
+        self._selector_index: set = set()
+        # Action dispatch: one table lookup per attempt instead of an
+        # if/elif ladder that grows with every new action type. Handlers
+        # return an outcome sentinel ("continue" / "return_true" /
+        # "return_false") that the loop acts on.
+        self._handlers = {
+            "click": self._do_click,
+            "type": self._do_type,
+            "select": self._do_select,
+            "finish": self._do_finish,
+            "fail": self._do_fail,
+        }
+        # Progress lines are logged (INFO/DEBUG), not printed: under parallel
+        # runs or captured stdout, print() serializes on the stream lock.
+        if verbose:
+            logger.setLevel(logging.INFO)
+
+    async def _release_browser(self):
+        """Resets the warm context for the next run, or closes it when the
+        orchestrator is not persistent. Either way the session (cookies,
+        localStorage) is saved first when a storage path is configured, so
+        the next run skips logins and reuses cached origin state."""
+        self._cancel_speculative()
+        await self.browser_controller.save_storage_state()
+        if self.persistent:
+            await self.browser_controller.reset()
+        else:
+            await self.browser_controller.shutdown()
+
+    async def shutdown(self):
+        """Closes the browser context."""
+        await self.browser_controller.shutdown()
+
+    async def __aenter__(self):
+        await self.browser_controller.start()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.shutdown()
+
+    async def _wait_for_page(self):
+        """Waits for the page to settle after an action, bounded by
+        settle_timeout_ms instead of sleeping a fixed interval."""
+        if self.settle_timeout_ms > 0:
+            await self.browser_controller.wait_for_ready(timeout_ms=self.settle_timeout_ms)
+
+    def _window_history(self, history: list[dict]) -> list[dict]:
+        """
+        Returns the history as sent to the provider: the last history_window
+        entries verbatim, preceded by a single summary entry covering
+        everything older. The summary is recomputed only when more entries
+        have aged out since the last call.
+        """
+        if len(history) <= self.history_window:
+            return history
+        older = history[:-self.history_window]
+        if len(older) != self._summarized_len:
+            self._history_summary = self.ai_provider.summarize_history(older)
+            self._summarized_len = len(older)
+        summary_entry = {"action": "summary", "status": "info", "reasoning": self._history_summary}
+        return [summary_entry] + history[-self.history_window:]
+
+    @staticmethod
+    def _objective_tokens(objective: str) -> frozenset:
+        return frozenset(re.findall(r"\w+", objective.lower()))
+
+    @staticmethod
+    def _literals_consistent(cached_objective: str, objective: str, actions: list[dict]) -> bool:
+        """
+        True when every typed text / selected value that the cached sequence
+        took from its objective also appears in the new objective. Two
+        objectives differing only in a data parameter (another email, another
+        search phrase) clear the Jaccard bar easily, and replaying would type
+        the *old* literal and report success for work that was never done;
+        literals absent from the cached objective (e.g. site-specific
+        constants) cannot discriminate and are ignored.
+        """
+        cached_low, new_low = cached_objective.lower(), objective.lower()
+        for action in actions:
+            for literal in (action.get("text"), action.get("value")):
+                if literal and literal.lower() in cached_low and literal.lower() not in new_low:
+                    return False
+        return True
+
+    def _fuzzy_skill_lookup(self, objective: str, start_url: str, threshold: float = 0.8):
+        """
+        Second-tier skill-cache lookup for paraphrased objectives ("log in as
+        admin" vs "sign in with the admin account"): token-set Jaccard
+        similarity against cached objectives for the same start URL. Returns
+        (actions, similarity) of the best match at or above the threshold, or
+        (None, 0.0). Selector drift is caught by replay re-validation, but a
+        near-duplicate objective with different data would replay cleanly, so
+        candidates whose action literals contradict the new objective are
+        rejected here (see _literals_consistent).
+        """
+        target = self._objective_tokens(objective)
+        best_actions, best_sim = None, threshold
+        for (cached_objective, cached_url), actions in Orchestrator._skill_cache.items():
+            if cached_url != start_url or cached_objective == objective:
+                continue
+            tokens = self._objective_tokens(cached_objective)
+            union = target | tokens
+            if not union:
+                continue
+            similarity = len(target & tokens) / len(union)
+            if similarity >= best_sim and self._literals_consistent(cached_objective, objective, actions):
+                best_sim, best_actions = similarity, actions
+        return (best_actions, best_sim) if best_actions is not None else (None, 0.0)
+
+    @staticmethod
+    def _is_valid_cached_sequence(cached_actions) -> bool:
+        """A replayable sequence is a non-empty list of action dicts."""
+        return (isinstance(cached_actions, list) and len(cached_actions) > 0
+                and all(isinstance(a, dict) and a.get("action") for a in cached_actions))
+
+    async def _replay_cached_actions(self, cached_actions: list[dict], history: list[dict]) -> bool:
+        """
+        Replays a previously successful action sequence without consulting the
+        AI. Returns True if the whole sequence (ending in "finish") applied
+        cleanly; returns False as soon as a cached selector no longer matches,
+        leaving the normal loop to take over from the current page state.
+        """
+        for action in cached_actions:
+            action_type = action.get("action")
+            selector = action.get("selector")
+
+            if action_type == "finish":
+                history.append({**action, "status": "success", "reasoning": "Replayed from skill cache."})
+                return True
 
-    def run_test(self, objective: str, start_url: str) -> tuple[bool, list[dict]]:
+            if not selector or not await self.browser_controller.selector_exists(selector):
+                logger.info("Skill cache miss: selector %s no longer matches. Falling back to AI loop.", selector)
+                return False
+
+            logger.info("Replaying cached action: %s on %s", action_type, selector)
+            if action_type == "click":
+                await self.browser_controller.click_element(selector)
+            elif action_type == "type":
+                await self.browser_controller.type_in_element(selector, action.get("text"))
+            elif action_type == "select":
+                await self.browser_controller.select_option(selector, action.get("value"))
+            else:
+                return False
+            history.append({**action, "status": "replayed", "reasoning": "Replayed from skill cache."})
+            await self._wait_for_page()
+
+        return False
+
+    @staticmethod
+    def _dom_fingerprint(dom) -> int:
+        """Cheap order-sensitive fingerprint of a simplified-DOM snapshot,
+        used to tell whether the page changed between two observations."""
+        return hash(tuple((el.tag, el.selector, el.text_content[:40]) for el in dom))
+
+    @staticmethod
+    def _dom_digest(dom) -> str:
+        """Stable cross-process counterpart of _dom_fingerprint (hash() is
+        salted per process), used to key the on-disk plan memo."""
+        h = hashlib.blake2b(digest_size=16)
+        for el in dom:
+            h.update(f"{el.tag}\x00{el.selector}\x00{el.text_content[:40]}\x01".encode())
+        return h.hexdigest()
+
+    def _cancel_speculative(self):
+        """
+        Cancels any in-flight speculative planning call. Run when a test ends
+        (success, failure or abort) and before a new run starts, so the task
+        is not destroyed while pending and a stale plan cannot leak into the
+        next run of a persistent orchestrator.
+        """
+        if self._speculative is not None:
+            task, _ = self._speculative
+            task.cancel()
+            self._speculative = None
+
+    async def _adopt_speculative_plan(self, current_dom, last_status: str):
+        """
+        Adopts the speculatively planned actions if the page ended up exactly
+        where the speculation assumed: the executed action succeeded and the
+        DOM fingerprint is unchanged. Otherwise the in-flight result is
+        discarded (the thread finishes in the background).
+        """
+        task, pre_action_fp = self._speculative
+        self._speculative = None
+        if last_status != "success" or self._dom_fingerprint(current_dom) != pre_action_fp:
+            task.cancel()
+            return
+        try:
+            plan = await task
+        except Exception as e:
+            logger.warning("Speculative planning failed: %s", e)
+            return
+        self.plan_queue = [a for a in plan if a.get("action") != "fail"]
+        # Speculative plans are never written to the on-disk cache, so an
+        # error during one must not invalidate whatever key was active last.
+        self._active_plan_key = None
+        if self.plan_queue:
+            logger.debug("Adopted speculative plan computed during the previous action.")
+
+    async def _next_planned_action(self, known_selectors: set, last_status: str):
+        """
+        Pops the next queued action if the plan is still trustworthy: the
+        previous step must have succeeded and the action's selector (when it
+        needs one) must match the page just observed. AI-constructed selectors
+        (e.g. button:has-text(...)) never appear among the DOM-derived ones,
+        so a membership miss falls back to a live locator count before the
+        queue is flushed for re-planning.
+        """
+        if not self.plan_queue:
+            return None
+        if last_status != "success":
+            self.plan_queue.clear()
+            return None
+
+        action = self.plan_queue[0]
+        selector = action.get("selector")
+        if action.get("action") in ("click", "type", "select"):
+            if selector not in known_selectors and (
+                    not selector or not await self.browser_controller.selector_exists(selector)):
+                logger.info("Planned selector %s not found on page; re-planning.", selector)
+                self.plan_queue.clear()
+                return None
+        return self.plan_queue.pop(0)
+
+    async def _selector_reachable(self, selector: str) -> bool:
+        """
+        Cheap existence gate run before an action. Membership in the observed
+        DOM's derived selectors costs nothing; AI-constructed selectors (e.g.
+        button:has-text(...)) fall back to an immediate locator count, which
+        still avoids the action call's multi-second actionability wait when
+        the selector matches nothing.
+        """
+        if selector in self._selector_index:
+            return True
+        return await self.browser_controller.selector_exists(selector)
+
+    async def _do_click(self, action: dict, record: ActionRecord) -> str:
+        if not record.selector:
+            logger.error("AI action 'click' missing 'selector'.")
+            record.status = "error"
+            record.error_message = "Missing selector for click action."
+        elif not await self._selector_reachable(record.selector):
+            logger.error("Selector %s for 'click' matches nothing in the observed DOM.", record.selector)
+            record.status = "error"
+            record.error_message = f"Selector not found in observed DOM: {record.selector}"
+        else:
+            try:
+                logger.debug("Attempting to click: %s", record.selector)
+                await self.browser_controller.click_element(record.selector)
+                record.status = "success"
+            except Exception as e:
+                logger.error("Error clicking element %s: %s", record.selector, e)
+                record.status = "error"
+                record.error_message = str(e)
+        return "continue"
+
+    async def _do_type(self, action: dict, record: ActionRecord) -> str:
+        if not record.selector or record.text is None: # text can be empty string
+            logger.error("AI action 'type' missing 'selector' or 'text'.")
+            record.status = "error"
+            record.error_message = "Missing selector or text for type action."
+        elif not await self._selector_reachable(record.selector):
+            logger.error("Selector %s for 'type' matches nothing in the observed DOM.", record.selector)
+            record.status = "error"
+            record.error_message = f"Selector not found in observed DOM: {record.selector}"
+        else:
+            try:
+                logger.debug("Attempting to type %r into: %s", record.text, record.selector)
+                await self.browser_controller.type_in_element(record.selector, record.text)
+                record.status = "success"
+            except Exception as e:
+                logger.error("Error typing into element %s: %s", record.selector, e)
+                record.status = "error"
+                record.error_message = str(e)
+        return "continue"
+
+    async def _do_select(self, action: dict, record: ActionRecord) -> str:
+        if not record.selector or not record.value:
+            logger.error("AI action 'select' missing 'selector' or 'value'.")
+            record.status = "error"
+            record.error_message = "Missing selector or value for select action."
+        elif not await self._selector_reachable(record.selector):
+            logger.error("Selector %s for 'select' matches nothing in the observed DOM.", record.selector)
+            record.status = "error"
+            record.error_message = f"Selector not found in observed DOM: {record.selector}"
+        else:
+            try:
+                logger.debug("Attempting to select option %r in: %s", record.value, record.selector)
+                await self.browser_controller.select_option(record.selector, record.value)
+                record.status = "success"
+            except Exception as e:
+                logger.error("Error selecting option in %s: %s", record.selector, e)
+                record.status = "error"
+                record.error_message = str(e)
+        return "continue"
+
+    async def _do_finish(self, action: dict, record: ActionRecord) -> str:
+        logger.info("Objective achieved. Reason: %s", record.reasoning)
+        record.status = "success"
+        return "return_true"
+
+    async def _do_fail(self, action: dict, record: ActionRecord) -> str:
+        logger.warning("AI indicated failure to achieve objective. Reason: %s", record.reasoning)
+        record.status = "failed_by_ai"
+        return "return_false"
+
+    async def _do_unknown(self, action: dict, record: ActionRecord) -> str:
+        logger.error("Unknown action type %r received from AI.", record.action)
+        record.status = "error"
+        record.error_message = f"Unknown AI action type: {record.action}"
+        return "continue"
+
+    async def run_test(self, objective: str, start_url: str, record_sink=None) -> tuple[bool, list[dict]]:
         """
         Runs the AI-driven test loop.
 
         Args:
             objective: The high-level goal for the agent.
             start_url: The initial URL to navigate to.
+            record_sink: Optional callable invoked with each history record
+                as it is produced, for callers that stream records to disk.
 
         Returns:
             A tuple containing:
                 - bool: True if the objective was achieved ("finish"), False otherwise.
                 - list[dict]: The history of actions taken.
         """
-        history = []
+        history = _RecordingHistory(record_sink) if record_sink is not None else []
 
-        print(f"Navigating to start URL: {start_url}")
-        self.browser_controller.navigate(start_url)
+        await self.browser_controller.start()
+        logger.info("Navigating to start URL: %s", start_url)
+        await self.browser_controller.navigate(start_url)
         history.append({"action": "navigate", "url": start_url, "status": "success", "reasoning": "Initial navigation"})
 
-        for attempt in range(self.max_attempts):
-            print(f"\\n--- Attempt {attempt + 1}/{self.max_attempts} ---")
+        # Fast path: replay a previously successful sequence for this exact
+        # objective/URL, skipping DOM extraction and AI calls entirely. The
+        # in-process cache is checked first, then the on-disk cache shared
+        # across processes. Every replayed step re-validates its selector, so
+        # a drifted page falls through to the normal loop (and evicts the
+        # stale disk entry).
+        disk_key = plan_cache.fingerprint(objective, start_url)
+        cached_actions = Orchestrator._skill_cache.get((objective, start_url))
+        if not cached_actions:
+            cached_actions = plan_cache.get("plans", disk_key)
+            if not self._is_valid_cached_sequence(cached_actions):
+                cached_actions = None
+        if not cached_actions:
+            cached_actions, similarity = self._fuzzy_skill_lookup(objective, start_url)
+            if cached_actions:
+                logger.info("Fuzzy skill-cache hit (similarity %.2f); attempting replay.", similarity)
+        if cached_actions:
+            logger.info("Found cached action sequence for this objective. Attempting replay...")
+            if await self._replay_cached_actions(cached_actions, history):
+                logger.info("Objective achieved via skill-cache replay.")
+                Orchestrator._skill_cache[(objective, start_url)] = cached_actions
+                await self._release_browser()
+                return True, history
+            plan_cache.invalidate("plans", disk_key)
+
+        # Seed with any steps a partial replay already executed (status
+        # "replayed" in history): the sequence persisted on finish must run
+        # from the start URL, and storing only the post-fallback suffix
+        # would poison the skill cache for the next run.
+        successful_actions = [
+            {"action": r["action"], "selector": r.get("selector"),
+             "text": r.get("text"), "value": r.get("value")}
+            for r in history if r.get("status") == "replayed"
+        ]
+        self._cancel_speculative()
+        self.plan_queue.clear()
+        self._plan_cache.clear()
+        self._last_fp = None
+        self._prev_sent_dom = None
+        self._history_summary = None
+        self._summarized_len = 0
+        self._active_plan_key = None
+        self._last_dom = None
+        self._last_mutation_token = None
+        last_status = "success"
+        consecutive_errors = 0
 
-            # 1. Observe
-            print("Observing page DOM...")
+        for attempt in range(self.max_attempts):
+            logger.info("--- Attempt %d/%d ---", attempt + 1, self.max_attempts)
+
+            # 1. Observe — while the browser round-trip for the DOM is in
+            # flight, serialize the history block of the upcoming prompt on a
+            # thread; both are needed before planning and are independent.
+            logger.debug("Observing page DOM...")
+            windowed_history = self._window_history(history)
+            prefix_task = asyncio.create_task(asyncio.to_thread(
+                self.ai_provider.build_prompt_prefix, objective, windowed_history,
+            ))
             try:
-                current_dom = self.browser_controller.get_simplified_dom()
-                if not current_dom:
-                    print("Warning: Current DOM is empty or could not be fetched.")
-                    # Potentially add a small delay and retry DOM fetching once
-                    time.sleep(1)
-                    current_dom = self.browser_controller.get_simplified_dom()
+                # The token is read before extraction, so mutations racing the
+                # extractor force a re-fetch next attempt rather than a skip.
+                mutation_token = await self.browser_controller.get_mutation_token()
+                if (mutation_token is not None and self._last_dom is not None
+                        and mutation_token == self._last_mutation_token):
+                    logger.debug("Page unmutated since last observation; reusing DOM snapshot.")
+                    current_dom = self._last_dom
+                else:
+                    current_dom = await self.browser_controller.get_simplified_dom()
                     if not current_dom:
-                         print("Error: DOM is still empty after retry. Failing attempt.")
-                         history.append({"action": "error", "message": "Failed to retrieve DOM.", "status": "error"})
-                         # Consider if this should be a hard fail or if AI should try to proceed
-                         # For now, let AI decide based on empty DOM if it gets there
+                        logger.warning("Current DOM is empty or could not be fetched.")
+                        # Wait for the document body (bounded) and retry DOM fetching once
+                        await self.browser_controller.wait_for_body(timeout_ms=1000)
+                        current_dom = await self.browser_controller.get_simplified_dom()
+                        if not current_dom:
+                             logger.error("DOM is still empty after retry. Failing attempt.")
+                             history.append({"action": "error", "message": "Failed to retrieve DOM.", "status": "error"})
+                             # Consider if this should be a hard fail or if AI should try to proceed
+                             # For now, let AI decide based on empty DOM if it gets there
+                    self._last_dom = current_dom
+                    self._last_mutation_token = mutation_token
             except Exception as e:
-                print(f"Error during DOM observation: {e}")
+                logger.error("Error during DOM observation: %s", e)
                 history.append({"action": "error", "message": f"DOM observation failed: {e}", "status": "error"})
                 # Let AI try to handle this, or fail if it can't
                 current_dom = []
+            history_prefix = await prefix_task
+
+
+            current_fp = self._dom_fingerprint(current_dom)
+
+            # Fold in any plan that was speculatively computed while the
+            # previous action executed, if the page matches its assumptions.
+            if self._speculative is not None:
+                await self._adopt_speculative_plan(current_dom, last_status)
+
+            # 2. Plan — reuse the queued plan while it stays valid; otherwise
+            # ask the AI for a fresh plan of up to plan_depth actions.
+            known_selectors = {el.selector for el in current_dom if el.selector}
+            self._selector_index = known_selectors
+            prompt_dom = None
+            ai_action = await self._next_planned_action(known_selectors, last_status)
+            if ai_action is None:
+                plan = None
+                plan_history = windowed_history
+                if current_fp == self._last_fp and last_status == "success":
+                    # The DOM is byte-identical to what the AI already saw and
+                    # the action "succeeded" — i.e. it had no observable
+                    # effect. Re-asking with the same context would get the
+                    # same answer, so nudge the model explicitly.
+                    logger.info("DOM unchanged after successful action; nudging AI to choose differently.")
+                    plan_history = plan_history + [{
+                        "action": "observation",
+                        "status": "warning",
+                        "reasoning": "The previous action succeeded but had no observable effect on the page. Choose a different approach.",
+                    }]
+                elif (objective, current_fp) in self._plan_cache:
+                    # Identical page state seen earlier in this run: reuse the
+                    # plan instead of paying another identical LLM call.
+                    logger.info("Reusing cached plan for recurring DOM state.")
+                    plan = list(self._plan_cache[(objective, current_fp)])
+                    # Point the invalidation key at this page state's disk
+                    # entry; leaving the previous key in place would evict
+                    # an unrelated plan if a step of this one errors.
+                    self._active_plan_key = plan_cache.fingerprint(objective, self._dom_digest(current_dom))
+                else:
+                    # Same objective and page state planned by an earlier
+                    # process: reuse the memoized plan from disk.
+                    dom_key = plan_cache.fingerprint(objective, self._dom_digest(current_dom))
+                    cached_plan = plan_cache.get("actions", dom_key)
+                    if self._is_valid_cached_sequence(cached_plan):
+                        logger.info("Reusing on-disk plan for this page state.")
+                        plan = cached_plan
+                        self._plan_cache[(objective, current_fp)] = list(plan)
+                        self._active_plan_key = dom_key
+
+                if plan is None:
+                    logger.debug("Asking AI for next action plan...")
+                    # Keep only objective-relevant elements on oversized pages,
+                    # then collapse repetitive listing/grid runs; the diff is
+                    # taken over this reduced form so delta and full prompts
+                    # stay consistent.
+                    prompt_dom = dom_compact.compact(dom_filter.filter_dom(current_dom, objective))
+                    dom_delta = None
+                    if self._prev_sent_dom is not None:
+                        dom_delta = AIProvider.diff_dom(self._prev_sent_dom, prompt_dom)
+                    # The precomputed prefix only matches when the history was
+                    # not augmented (e.g. with a nudge entry) after it was built.
+                    plan = await self.ai_provider.aget_next_action_plan(
+                        objective, plan_history, prompt_dom, self.plan_depth,
+                        dom_delta,
+                        history_prefix if plan_history is windowed_history else None,
+                    )
+                    self._prev_sent_dom = prompt_dom
+                    self._plan_cache[(objective, current_fp)] = list(plan)
+                    dom_key = plan_cache.fingerprint(objective, self._dom_digest(current_dom))
+                    plan_cache.put("actions", dom_key, list(plan))
+                    self._active_plan_key = dom_key
+                ai_action = plan[0] if plan else {"action": "fail", "reasoning": "AI returned an empty plan."}
+                self.plan_queue = list(plan[1:])
+            else:
+                logger.debug("Executing next action from the current plan.")
+            self._last_fp = current_fp
 
-
-            # 2. Plan
-            print("Asking AI for next action...")
-            ai_action = self.ai_provider.get_next_action(objective, history, current_dom)
-
-            print(f"AI suggested action: {ai_action}")
+            logger.info("AI suggested action: %s", ai_action)
 
             action_type = ai_action.get("action")
             action_selector = ai_action.get("selector")
@@ -63,96 +599,132 @@ class Orchestrator:
             action_value = ai_action.get("value")
             action_reasoning = ai_action.get("reasoning", "No reasoning provided by AI.")
 
-            current_action_record = {
-                "action": action_type,
-                "selector": action_selector,
-                "text": action_text,
-                "value": action_value,
-                "reasoning": action_reasoning,
-                "status": "pending"
-            }
+            current_action_record = ActionRecord(
+                action=action_type,
+                selector=action_selector,
+                text=action_text,
+                value=action_value,
+                reasoning=action_reasoning,
+            )
+
+            # If this step drains the plan, start planning the next batch now,
+            # overlapping the LLM round-trip with the browser action and the
+            # settle wait. The speculation assumes this action succeeds and
+            # leaves the DOM unchanged; _adopt_speculative_plan verifies both
+            # before the result is ever used.
+            if not self.plan_queue and action_type in ("click", "type", "select"):
+                speculative_history = self._window_history(history) + [{**current_action_record.to_dict(), "status": "success"}]
+                # Send the same filtered/compacted DOM form as the main
+                # planning path, reusing this attempt's reduction when the
+                # fresh-plan branch already paid for it.
+                if prompt_dom is None:
+                    prompt_dom = dom_compact.compact(dom_filter.filter_dom(current_dom, objective))
+                task = asyncio.create_task(self.ai_provider.aget_next_action_plan(
+                    objective, speculative_history, prompt_dom, self.plan_depth,
+                ))
+                self._speculative = (task, current_fp)
 
             # 3. Act
-            if action_type == "click":
-                if not action_selector:
-                    print("Error: AI action 'click' missing 'selector'.")
-                    current_action_record["status"] = "error"
-                    current_action_record["error_message"] = "Missing selector for click action."
-                else:
-                    try:
-                        print(f"Attempting to click: {action_selector}")
-                        self.browser_controller.click_element(action_selector)
-                        current_action_record["status"] = "success"
-                    except Exception as e:
-                        print(f"Error clicking element {action_selector}: {e}")
-                        current_action_record["status"] = "error"
-                        current_action_record["error_message"] = str(e)
-
-            elif action_type == "type":
-                if not action_selector or action_text is None: # text can be empty string
-                    print("Error: AI action 'type' missing 'selector' or 'text'.")
-                    current_action_record["status"] = "error"
-                    current_action_record["error_message"] = "Missing selector or text for type action."
-                else:
-                    try:
-                        print(f"Attempting to type '{action_text}' into: {action_selector}")
-                        self.browser_controller.type_in_element(action_selector, action_text)
-                        current_action_record["status"] = "success"
-                    except Exception as e:
-                        print(f"Error typing into element {action_selector}: {e}")
-                        current_action_record["status"] = "error"
-                        current_action_record["error_message"] = str(e)
-
-            elif action_type == "select":
-                if not action_selector or not action_value:
-                    print("Error: AI action 'select' missing 'selector' or 'value'.")
-                    current_action_record["status"] = "error"
-                    current_action_record["error_message"] = "Missing selector or value for select action."
-                else:
-                    try:
-                        print(f"Attempting to select option '{action_value}' in: {action_selector}")
-                        self.browser_controller.select_option(action_selector, action_value)
-                        current_action_record["status"] = "success"
-                    except Exception as e:
-                        print(f"Error selecting option in {action_selector}: {e}")
-                        current_action_record["status"] = "error"
-                        current_action_record["error_message"] = str(e)
-
-            elif action_type == "finish":
-                print(f"Objective achieved: {objective}. Reason: {action_reasoning}")
-                current_action_record["status"] = "success"
-                history.append(current_action_record)
-                self.browser_controller.shutdown()
+            handler = self._handlers.get(action_type, self._do_unknown)
+            outcome = await handler(ai_action, current_action_record)
+
+            if outcome == "return_true":
+                history.append(current_action_record.to_dict())
+                # Remember the successful sequence so an identical run can
+                # replay it without DOM extraction or AI calls.
+                successful_actions.append({"action": "finish"})
+                Orchestrator._skill_cache[(objective, start_url)] = successful_actions
+                plan_cache.put("plans", disk_key, successful_actions)
+                await self._release_browser()
                 return True, history
 
-            elif action_type == "fail":
-                print(f"AI indicated failure to achieve objective. Reason: {action_reasoning}")
-                current_action_record["status"] = "failed_by_ai"
-                history.append(current_action_record)
-                self.browser_controller.shutdown()
+            if outcome == "return_false":
+                history.append(current_action_record.to_dict())
+                await self._release_browser()
                 return False, history
 
+            if current_action_record.status == "success" and action_type in ("click", "type", "select"):
+                successful_actions.append({
+                    "action": action_type,
+                    "selector": action_selector,
+                    "text": action_text,
+                    "value": action_value,
+                })
+
+            if current_action_record.status == "error" and self._active_plan_key:
+                plan_cache.invalidate("actions", self._active_plan_key)
+                self._active_plan_key = None
+
+            history.append(current_action_record.to_dict())
+            last_status = current_action_record.status
+
+            if last_status in ("error", "failed_by_ai"):
+                consecutive_errors += 1
+                if consecutive_errors >= self.max_consecutive_errors:
+                    logger.error("Aborting after %d consecutive errors.", consecutive_errors)
+                    history.append({
+                        "action": "abort",
+                        "status": "error",
+                        "reasoning": f"Aborted after {consecutive_errors} consecutive error attempts.",
+                    })
+                    await self._release_browser()
+                    return False, history
             else:
-                print(f"Error: Unknown action type '{action_type}' received from AI.")
-                current_action_record["status"] = "error"
-                current_action_record["error_message"] = f"Unknown AI action type: {action_type}"
+                consecutive_errors = 0
 
-            history.append(current_action_record)
+            # Wait for the page to react to the action — event-driven with a
+            # bounded ceiling, so fast pages advance immediately. Skipped
+            # entirely when the action never executed (missing/unknown
+            # selector, validation error): the page was not touched, so there
+            # is nothing to settle.
+            if last_status == "success":
+                await self._wait_for_page()
 
-            # Small delay to allow page to update after an action, and to make it watchable
-            time.sleep(2) # TODO: Make configurable or smarter (e.g., wait for specific conditions)
-
-            if current_action_record["status"] == "error" or current_action_record["status"] == "failed_by_ai":
+            if current_action_record.status == "error" or current_action_record.status == "failed_by_ai":
                 # If an action results in an error, or AI explicitly fails, consider if we should stop early.
                 # For now, we'll let it run max_attempts unless AI says "fail" or "finish".
                 # If an operational error occurs (e.g. can't click), the next DOM might help AI recover.
-                print(f"Action resulted in status: {current_action_record['status']}. Continuing if attempts remain.")
+                logger.info("Action resulted in status: %s. Continuing if attempts remain.", current_action_record.status)
 
 
-        print(f"Max attempts ({self.max_attempts}) reached. Objective may not have been fully achieved.")
-        self.browser_controller.shutdown()
+        logger.warning("Max attempts (%d) reached. Objective may not have been fully achieved.", self.max_attempts)
+        await self._release_browser()
         return False, history
 
+
+    async def run_many(self, tasks: list[tuple[str, str]], concurrency: int = 5) -> list:
+        """
+        Runs several (objective, start_url) tests concurrently, at most
+        `concurrency` at a time. Each task gets its own Orchestrator and thus
+        its own BrowserContext (contexts from the shared browser process are
+        fully isolated), while the AI provider and loop settings are shared.
+
+        Returns a list aligned with `tasks`: each entry is the (success,
+        history) tuple from run_test, or the exception that task raised.
+        """
+        sem = asyncio.Semaphore(concurrency)
+
+        async def run_one(objective: str, start_url: str):
+            async with sem:
+                orchestrator = Orchestrator(
+                    self.ai_provider,
+                    max_attempts=self.max_attempts,
+                    settle_timeout_ms=self.settle_timeout_ms,
+                    plan_depth=self.plan_depth,
+                    persistent=False,
+                    max_consecutive_errors=self.max_consecutive_errors,
+                    history_window=self.history_window,
+                )
+                try:
+                    return await orchestrator.run_test(objective, start_url)
+                finally:
+                    await orchestrator.shutdown()
+
+        return await asyncio.gather(
+            *(run_one(objective, url) for objective, url in tasks),
+            return_exceptions=True,
+        )
+
 if __name__ == '__main__':
     # This is a conceptual test. It requires a mock AIProvider.
     class MockAIProvider(AIProvider):
@@ -171,6 +743,9 @@ if __name__ == '__main__':
                 return {"action": "finish", "reasoning": "Search results page loaded, objective met."}
             return {"action": "fail", "reasoning": "Mock AI stuck."}
 
+    import os
+
+    logging.basicConfig(level=logging.INFO)
     print("Testing Orchestrator with MockAIProvider...")
 
     # We need a config/.env for BrowserController to init Playwright, even if AI is mocked.
@@ -205,7 +780,7 @@ if __name__ == '__main__':
 
     print(f"Starting orchestrator test with objective: '{test_objective}' and URL: '{test_start_url}'")
 
-    success, history_log = orchestrator.run_test(test_objective, test_start_url)
+    success, history_log = asyncio.run(orchestrator.run_test(test_objective, test_start_url))
 
     print(f"\\nOrchestrator test finished. Success: {success}")
     print("History Log:")
@@ -0,0 +1,34 @@
+from __future__ import annotations
+
+from dataclasses import dataclass
+
+
+@dataclass(slots=True)
+class ActionRecord:
+    """
+    One attempted action and its outcome, as tracked by the orchestrator
+    loop. Slots keep the per-attempt record a flat fixed-layout object
+    instead of a dict that is allocated and re-hashed on every mutation;
+    records are converted to plain dicts only at the history boundary.
+    """
+    action: str | None
+    selector: str | None = None
+    text: str | None = None
+    value: str | None = None
+    reasoning: str = ""
+    status: str = "pending"
+    error_message: str | None = None
+
+    def to_dict(self) -> dict:
+        """Plain-dict form used in history; error_message only when set."""
+        record = {
+            "action": self.action,
+            "selector": self.selector,
+            "text": self.text,
+            "value": self.value,
+            "reasoning": self.reasoning,
+            "status": self.status,
+        }
+        if self.error_message is not None:
+            record["error_message"] = self.error_message
+        return record
@@ -1,12 +1,15 @@
+import asyncio
 from abc import ABC, abstractmethod
 
+from agent.browser.dom import DOMElement
+
 class AIProvider(ABC):
     """
     Abstract base class for AI providers.
     Defines the interface for getting the next action from an AI model.
     """
     @abstractmethod
-    def get_next_action(self, objective: str, history: list[dict], dom: list[dict]) -> dict:
+    def get_next_action(self, objective: str, history: list[dict], dom: list[DOMElement]) -> dict:
         """
         Determines the next browser action to take based on the objective,
         history of previous actions, and the current state of the DOM.
@@ -15,9 +18,9 @@ class AIProvider(ABC):
             objective: The overall goal for the AI agent.
             history: A list of dictionaries, where each dictionary represents a past action
                      and its outcome. E.g., {"action": "click", "selector": "#id", "status": "success"}
-            dom: A list of dictionaries representing the simplified interactive elements
-                 of the current webpage. Each dictionary contains details like tag, attributes,
-                 and selector for an element.
+            dom: A list of DOMElement instances representing the simplified interactive
+                 elements of the current webpage. Each element carries its tag, identifying
+                 attributes, and a derived selector when one exists.
 
         Returns:
             A dictionary representing the next action to take.
@@ -33,3 +36,82 @@ class AIProvider(ABC):
             If the objective cannot be achieved or an error occurs, action should be "fail".
         """
         pass
+
+    def build_prompt_prefix(self, objective: str, history: list[dict]) -> str | None:
+        """
+        Pre-serializes the history-dependent part of the prompt so callers can
+        do it while browser I/O is in flight, then hand the result back via
+        get_next_action_plan's history_json argument. The default returns
+        None, meaning the provider serializes lazily as usual.
+        """
+        return None
+
+    def get_next_action_plan(self, objective: str, history: list[dict], dom: list[DOMElement], k: int = 3,
+                             dom_delta: dict | None = None, history_json: str | None = None) -> list[dict]:
+        """
+        Returns a short plan of up to k next actions (same dicts as
+        get_next_action), in execution order. One model round-trip can then
+        cover several steps, with the orchestrator re-planning as soon as a
+        step fails or the page diverges from what the plan assumed.
+
+        dom_delta, when given, is the diff_dom() result against the DOM the
+        provider was last shown. Providers may use it to describe unchanged
+        elements compactly in the prompt instead of repeating them in full;
+        ignoring it and sending the whole dom is always correct.
+
+        The default implementation plans a single step via get_next_action;
+        providers that can ask their model for multi-step plans should
+        override this.
+        """
+        return [self.get_next_action(objective, history, dom)]
+
+    async def aget_next_action_plan(self, objective: str, history: list[dict], dom: list[DOMElement], k: int = 3,
+                                    dom_delta: dict | None = None, history_json: str | None = None) -> list[dict]:
+        """
+        Async variant of get_next_action_plan. The default thunks the sync
+        implementation onto a worker thread so the event loop never blocks on
+        the model round-trip; providers built on an async HTTP client should
+        override this to reuse one keep-alive connection pool across calls.
+        """
+        return await asyncio.to_thread(
+            self.get_next_action_plan, objective, history, dom, k, dom_delta, history_json,
+        )
+
+    @staticmethod
+    def summarize_history(old_entries: list[dict]) -> str:
+        """
+        Collapses history entries that fell outside the prompt window into a
+        single sentence (per-action counts). Providers with a real
+        summarization path may override this with something richer.
+        """
+        counts: dict[str, int] = {}
+        for entry in old_entries:
+            action = entry.get("action") or "unknown"
+            counts[action] = counts.get(action, 0) + 1
+        parts = ", ".join(f"{n}x {action}" for action, n in counts.items())
+        return f"{len(old_entries)} earlier actions not shown: {parts}."
+
+    @staticmethod
+    def diff_dom(prev: list[DOMElement], curr: list[DOMElement]) -> dict:
+        """
+        Diffs two simplified-DOM snapshots, keyed by element selector.
+
+        Returns {"added": [...], "changed": [...], "removed": [selector, ...],
+        "unchanged": [...]} where the element lists hold DOMElement instances
+        from curr. Elements without a derived selector cannot be tracked
+        across snapshots and are always reported as added.
+        """
+        prev_by_sel = {el.selector: el for el in prev if el.selector}
+        added, changed, unchanged = [], [], []
+        seen = set()
+        for el in curr:
+            if not el.selector or el.selector not in prev_by_sel:
+                added.append(el)
+                continue
+            seen.add(el.selector)
+            if el == prev_by_sel[el.selector]:
+                unchanged.append(el)
+            else:
+                changed.append(el)
+        removed = [sel for sel in prev_by_sel if sel not in seen]
+        return {"added": added, "changed": changed, "removed": removed, "unchanged": unchanged}
@@ -0,0 +1,48 @@
+"""
+Content-addressed deduplication of prompt payloads.
+
+Retried actions repeat the same long reasoning, error and text strings
+across several history entries, and every repetition is billed again as
+prompt tokens. compress_history() replaces each long string that occurs
+more than once with a short content-addressed marker and returns the
+definitions table to emit once at the top of the history section.
+Unique or short strings pass through untouched, so the common case
+costs one dict walk.
+"""
+import hashlib
+
+# Below this length the marker plus its definition would cost about as
+# much as the repetition it removes.
+MIN_BLOB_LEN = 64
+
+
+def _ref_name(blob: str) -> str:
+    return "blob_" + hashlib.sha1(blob.encode("utf-8")).hexdigest()[:8]
+
+
+def compress_history(history: list[dict]) -> tuple[dict, list[dict]]:
+    """
+    Returns (definitions, compressed_history). Each string value of at
+    least MIN_BLOB_LEN chars occurring in two or more places is replaced
+    by a marker of the form §blob_xxxxxxxx§; definitions maps marker
+    names to the original strings. The input is not mutated.
+    """
+    counts: dict[str, int] = {}
+    for entry in history:
+        for value in entry.values():
+            if isinstance(value, str) and len(value) >= MIN_BLOB_LEN:
+                counts[value] = counts.get(value, 0) + 1
+
+    definitions: dict[str, str] = {}
+    compressed = []
+    for entry in history:
+        replaced = None
+        for key, value in entry.items():
+            if isinstance(value, str) and counts.get(value, 0) > 1:
+                if replaced is None:
+                    replaced = dict(entry)
+                name = _ref_name(value)
+                definitions[name] = value
+                replaced[key] = f"§{name}§"
+        compressed.append(replaced if replaced is not None else entry)
+    return definitions, compressed
@@ -1,117 +1,57 @@
+import asyncio
+import collections
+import functools
+import hashlib
+import logging
 import os
 import json
+import random
+import re
+import threading
+import time
 import google.generativeai as genai
 from dotenv import load_dotenv
+from agent import jsonutil
+from agent.browser.dom import DOMElement
+from agent.providers import dedup
 from agent.providers.base import AIProvider
 
-class GeminiProvider(AIProvider):
-    """
-    AIProvider implementation using Google's Gemini model.
-    """
-    def __init__(self, model_name="gemini-1.5-flash-latest"): # Or "gemini-pro" / "gemini-1.0-pro"
-        load_dotenv(dotenv_path=os.path.join(os.path.dirname(__file__), '..', '..', 'config', '.env'))
-        self.api_key = os.getenv("GOOGLE_API_KEY")
-        if not self.api_key:
-            raise ValueError("GOOGLE_API_KEY not found in environment variables. Ensure it's set in config/.env")
-
-        genai.configure(api_key=self.api_key)
-        self.model = genai.GenerativeModel(model_name)
-        self.generation_config = genai.types.GenerationConfig(
-            # Only one candidate for now
-            candidate_count=1,
-            # We want JSON output
-            response_mime_type="application/json",
-            temperature=0.2, # Lower temperature for more deterministic actions
-        )
-
-
-    def get_next_action(self, objective: str, history: list[dict], dom: list[dict]) -> dict:
-        """
-        Gets the next action from the Gemini model.
-        """
-        prompt = self._construct_prompt(objective, history, dom)
-
-        print("\\n----- Gemini Prompt -----")
-        print(prompt)
-        print("----- End Gemini Prompt -----\\n")
-
-        try:
-            response = self.model.generate_content(
-                prompt,
-                generation_config=self.generation_config
-            )
-
-            print("\\n----- Gemini Raw Response -----")
-            print(response.text) # Accessing .text directly as response_mime_type is application/json
-            print("----- End Gemini Raw Response -----\\n")
-
-            if response.parts:
-                # Assuming the response is valid JSON as requested
-                action_json_str = response.text
-                action_data = json.loads(action_json_str)
-
-                # Basic validation of the returned structure
-                if "action" not in action_data:
-                    print("Error: 'action' field missing in Gemini response.")
-                    return {"action": "fail", "reasoning": "AI response missing 'action' field."}
-
-                # Further validation can be added here based on action type
-                # e.g., if action is 'click', 'selector' should be present.
-
-                return action_data
-            else:
-                # Handle cases where response might be blocked or empty
-                print("Warning: Gemini response has no parts or might be blocked.")
-                # You might want to inspect response.prompt_feedback here for safety ratings
-                if response.prompt_feedback:
-                    print(f"Prompt Feedback: {response.prompt_feedback}")
-                return {"action": "fail", "reasoning": "AI response was empty or blocked."}
-
-        except json.JSONDecodeError as e:
-            print(f"Error decoding JSON from Gemini response: {e}")
-            print(f"Raw response was: {response.text if 'response' in locals() and hasattr(response, 'text') else 'N/A'}")
-            return {"action": "fail", "reasoning": f"Invalid JSON response from AI: {e}"}
-        except Exception as e:
-            print(f"Error calling Gemini API: {e}")
-            return {"action": "fail", "reasoning": f"API call failed: {e}"}
+logger = logging.getLogger(__name__)
 
-    def _construct_prompt(self, objective: str, history: list[dict], dom: list[dict]) -> str:
-        """
-        Constructs the detailed prompt for the Gemini model.
-        """
-        # Prune DOM to reduce token count if necessary, prioritize elements with clearer selectors or more info
-        # For now, we send the whole DOM as received.
-        # A more sophisticated approach might involve summarizing or filtering the DOM further.
 
-        dom_summary_for_prompt = []
-        for el in dom:
-            # Create a more compact representation for the prompt
-            summary = {
-                "tag": el.get("tag"),
-                "selector": el.get("selector"), # This is our generated one
-                "attributes": {k: v for k, v in el.get("attributes", {}).items() if k in ['id', 'name', 'aria-label', 'placeholder', 'role', 'type', 'href', 'data-testid']},
-                "text": el.get("text_content", "")[:100] # Truncate text
-            }
-            # Only include selector if it exists
-            if not summary["selector"]:
-                del summary["selector"] # Let the AI choose based on other attributes if no good selector
-
-            dom_summary_for_prompt.append(summary)
-
-
-        prompt = f"""You are an AI agent controlling a web browser to achieve a specific objective.
-Your task is to decide the next action to take based on the current state of the webpage and the history of actions taken so far.
-
-Objective: {objective}
-
-Current Simplified DOM (interactive elements only):
-{json.dumps(dom_summary_for_prompt, indent=2)}
+@functools.lru_cache(maxsize=1)
+def _load_config() -> str:
+    """
+    Loads config/.env and configures the genai SDK once per process,
+    returning the API key. Agents that build a provider per tab or per
+    objective then skip the repeated dotenv filesystem walk and
+    genai.configure calls. A failed load is not cached, so fixing the
+    environment and retrying works.
+    """
+    load_dotenv(dotenv_path=os.path.join(os.path.dirname(__file__), '..', '..', 'config', '.env'))
+    api_key = os.getenv("GOOGLE_API_KEY")
+    if not api_key:
+        raise ValueError("GOOGLE_API_KEY not found in environment variables. Ensure it's set in config/.env")
+    genai.configure(api_key=api_key)
+    return api_key
 
-History of actions taken so far (last 5 actions):
-{json.dumps(history[-5:], indent=2) if history else "No actions taken yet."}
 
-Based on the objective, the DOM, and the history, what is the next single action to perform?
-Your response MUST be a JSON object with the following structure:
+@functools.lru_cache(maxsize=None)
+def _prompt_tail(plan_k: int) -> str:
+    """
+    The static trailer of every prompt — plan wording, action schema,
+    guidelines and examples. It depends only on plan_k, never on the
+    objective or provider instance, so it is rendered once per process
+    and shared by every GeminiProvider.
+    """
+    return f"""
+{("Based on the objective, the DOM, and the history, plan the next actions to perform. "
+  f"Your response MUST be a JSON array of up to {plan_k} action objects in execution order. "
+  "Only include follow-up actions whose target elements you are confident will exist after the preceding steps "
+  "(e.g. typing into several fields of the same form); stop the plan at any page transition."
+  ) if plan_k > 1 else
+ "Based on the objective, the DOM, and the history, what is the next single action to perform?"}
+{"Each action object must have" if plan_k > 1 else "Your response MUST be a JSON object with"} the following structure:
 {{
   "action": "action_type",      // one of: "click", "type", "select", "finish", "fail"
   "selector": "CSS_selector",   // required for "click", "type", "select". Use the 'selector' field from DOM if available and suitable. Otherwise, construct a robust CSS selector.
@@ -121,7 +61,7 @@ Your response MUST be a JSON object with the following structure:
 }}
 
 Guidelines for choosing selectors:
-- Prefer selectors provided in the DOM elements if they are unique and stable (e.g., `#{el['attributes'].get('id')}`, `[name='{el['attributes'].get('name')}']`, `[data-testid='...']`).
+- Prefer selectors provided in the DOM elements if they are unique and stable (e.g., `#some-id`, `[name='some-name']`, `[data-testid='...']`).
 - If no good pre-defined selector, construct one using tag, attributes, and text. For example: `button:has-text('Submit')`, `input[name='email']`, `a[href*='product']`.
 - Be specific to avoid ambiguity.
 
@@ -138,15 +78,469 @@ If you are typing, ensure the element is an input or textarea.
 If you are selecting, ensure the element is a select and the value is one of its options.
 
 Example of choosing a selector for a button with text "Login" and id "login-btn":
-If DOM has: {{ "tag": "button", "selector": "#login-btn", "attributes": {{ "id": "login-btn" }}, "text": "Login" }}
+If DOM has: button #login-btn "Login" id=login-btn
 Your action: {{ "action": "click", "selector": "#login-btn", "reasoning": "Clicking the login button with id login-btn." }}
 
 Example for typing into a search bar:
-If DOM has: {{ "tag": "input", "attributes": {{ "name": "q", "aria-label": "Search" }}, "text": "" }}
+If DOM has: input name=q aria-label=Search
 Your action: {{ "action": "type", "selector": "input[name='q']", "text": "my search query", "reasoning": "Typing search query into the search bar." }}
 
-Now, provide the next action JSON object:
+{"Now, provide the planned actions as a JSON array:" if plan_k > 1 else "Now, provide the next action JSON object:"}
 """
+
+
+class GeminiProvider(AIProvider):
+    """
+    AIProvider implementation using Google's Gemini model.
+    """
+    # OpenAPI-style schema for a plan response, given to the API so the
+    # model decodes under the constraint instead of merely being asked to
+    # follow it — malformed JSON then never reaches the parse/repair
+    # path. Dict form because the SDK's typed schema classes have moved
+    # between versions; per-action conditional requirements are beyond
+    # what the schema language expresses, so _is_valid_actions still runs.
+    _RESPONSE_SCHEMA = {
+        "type": "array",
+        "items": {
+            "type": "object",
+            "properties": {
+                "action": {"type": "string",
+                           "enum": ["click", "type", "select", "finish", "fail"]},
+                "selector": {"type": "string"},
+                "text": {"type": "string"},
+                "value": {"type": "string"},
+                "reasoning": {"type": "string"},
+            },
+            "required": ["action"],
+        },
+    }
+    # Request-rate limiter state, shared across instances (and the worker
+    # threads aget_next_action_plan runs them on) since they all draw on
+    # the same per-key Gemini quota. Disabled unless GEMINI_RPM is set:
+    # calls spaced naturally by browser I/O need no artificial delay, and
+    # only bursts past the quota should ever wait.
+    _rate_lock = threading.Lock()
+    _last_call_at = 0.0
+
+    @classmethod
+    def _reserve_rate_slot(cls) -> float:
+        """
+        Claims the next call slot under GEMINI_RPM (if set) and returns how
+        long the caller must wait before using it — 0.0 when unthrottled.
+        """
+        rpm = os.getenv("GEMINI_RPM")
+        if not rpm:
+            return 0.0
+        try:
+            interval = 60.0 / float(rpm)
+        except (ValueError, ZeroDivisionError):
+            return 0.0
+        with cls._rate_lock:
+            now = time.monotonic()
+            wait = cls._last_call_at + interval - now
+            cls._last_call_at = max(now, cls._last_call_at + interval)
+        return max(wait, 0.0)
+
+    @classmethod
+    def _rate_limit(cls) -> None:
+        """Blocking form of _reserve_rate_slot for the sync call path."""
+        wait = cls._reserve_rate_slot()
+        if wait > 0:
+            time.sleep(wait)
+
+    def __init__(self, model_name="gemini-1.5-flash-latest", ai_retries=3, ai_backoff_base=0.5, ai_backoff_cap=8.0): # Or "gemini-pro" / "gemini-1.0-pro"
+        self.api_key = _load_config()
+
+        # Transient API failures (rate limits, 5xx) are retried with
+        # exponential backoff before a run-ending "fail" action is returned.
+        self.ai_retries = ai_retries
+        self.ai_backoff_base = ai_backoff_base
+        self.ai_backoff_cap = ai_backoff_cap
+        # Per-objective cache of the prompt header; the plan_k-dependent
+        # trailer lives in the module-level _prompt_tail so only the
+        # DOM/history sections are rendered per call.
+        self._prompt_cache: dict = {}
+        self.model_name = model_name
+        # Exact-match LRU over (model, objective, k, DOM, recent history)
+        # -> parsed plan. Retries and deterministic flows revisit identical
+        # states; a hit skips the whole network+inference round-trip. The
+        # orchestrator's own caches are keyed per-run — this one also
+        # serves concurrent run_many() orchestrators sharing the provider.
+        self._action_cache: collections.OrderedDict = collections.OrderedDict()
+        self._action_cache_max = 256
+        # Single-entry memo of the rendered full-DOM section. The main and
+        # speculative planning calls for one observation pass the same
+        # snapshot list, so the second render of a few hundred element
+        # lines is free.
+        self._dom_lines_key: tuple | None = None
+        self._dom_lines: str = ""
+
+        self.model = genai.GenerativeModel(model_name)
+        try:
+            self.generation_config = genai.types.GenerationConfig(
+                # Only one candidate for now
+                candidate_count=1,
+                # We want JSON output
+                response_mime_type="application/json",
+                response_schema=self._RESPONSE_SCHEMA,
+                temperature=0.2, # Lower temperature for more deterministic actions
+            )
+        except (TypeError, ValueError):
+            # SDK predates response_schema; the prompt's schema block plus
+            # response validation remain the only guardrails.
+            self.generation_config = genai.types.GenerationConfig(
+                candidate_count=1,
+                response_mime_type="application/json",
+                temperature=0.2,
+            )
+
+
+    def get_next_action(self, objective: str, history: list[dict], dom: list[DOMElement]) -> dict:
+        """
+        Gets the next action from the Gemini model.
+        """
+        return self.get_next_action_plan(objective, history, dom, k=1)[0]
+
+    @staticmethod
+    def _serialize_history(history: list[dict]) -> str:
+        """
+        The history section of the prompt: deduplicated (repeated long
+        strings become §blob_...§ markers defined once up front) and then
+        JSON-serialized.
+        """
+        if not history:
+            return "No actions taken yet."
+        definitions, compressed = dedup.compress_history(history)
+        section = jsonutil.dumps(compressed, indent=True)
+        if definitions:
+            section = ("Reference definitions (a §name§ marker below stands for its full string here):\n"
+                       + jsonutil.dumps(definitions, indent=True) + "\n" + section)
+        return section
+
+    def build_prompt_prefix(self, objective: str, history: list[dict]) -> str:
+        """Serializes the history block ahead of time (see AIProvider)."""
+        return self._serialize_history(history)
+
+    def _action_cache_key(self, objective: str, history: list[dict], dom: list[DOMElement], k: int) -> bytes:
+        """
+        blake2b over everything the model's answer can depend on: model,
+        objective, plan length, the full rendered DOM and the history as
+        passed in (callers window it before calling — hashing a shorter
+        slice than the prompt serializes would collide distinct contexts).
+        Keyed on the full DOM (not the delta form) so the same state hits
+        regardless of what the previous observation was.
+        """
+        digest = hashlib.blake2b(digest_size=16)
+        for part in (self.model_name, objective, str(k)):
+            digest.update(part.encode("utf-8"))
+            digest.update(b"\x00")
+        for el in dom:
+            digest.update(self._element_line(el).encode("utf-8"))
+            digest.update(b"\x00")
+        digest.update(json.dumps(history, sort_keys=True, default=str).encode("utf-8"))
+        return digest.digest()
+
+    def get_next_action_plan(self, objective: str, history: list[dict], dom: list[DOMElement], k: int = 3,
+                             dom_delta: dict | None = None, history_json: str | None = None,
+                             use_cache: bool = True) -> list[dict]:
+        """
+        Gets a plan of up to k next actions from the Gemini model in one call.
+        Always returns a non-empty list; on any error the list holds a single
+        "fail" action. Identical (state, history) queries are answered from
+        an exact-match LRU unless use_cache is False.
+        """
+        cache_key = self._action_cache_key(objective, history, dom, k) if use_cache else None
+        cached = self._cached_plan(cache_key)
+        if cached is not None:
+            return cached
+
+        prompt = self._construct_prompt(objective, history, dom, plan_k=k, dom_delta=dom_delta,
+                                        history_json=history_json)
+
+        logger.debug("Gemini prompt:\n%s", prompt)
+
+        try:
+            response = self._generate_with_retry(prompt)
+            return self._parse_plan_response(response, k, cache_key)
+        except ValueError as e:
+            logger.error("Error decoding JSON from Gemini response: %s", e)
+            logger.error("Raw response was: %s",
+                         response.text if 'response' in locals() and hasattr(response, 'text') else 'N/A')
+            return [{"action": "fail", "reasoning": f"Invalid JSON response from AI: {e}"}]
+        except Exception as e:
+            logger.error("Error calling Gemini API: %s", e)
+            return [{"action": "fail", "reasoning": f"API call failed: {e}"}]
+
+    async def aget_next_action_plan(self, objective: str, history: list[dict], dom: list[DOMElement], k: int = 3,
+                                    dom_delta: dict | None = None, history_json: str | None = None,
+                                    use_cache: bool = True) -> list[dict]:
+        """
+        Async counterpart of get_next_action_plan, built on the SDK's native
+        generate_content_async instead of the base class's worker-thread
+        fallback, so speculative and concurrent plans share one event loop
+        and connection pool rather than a thread apiece.
+        """
+        cache_key = self._action_cache_key(objective, history, dom, k) if use_cache else None
+        cached = self._cached_plan(cache_key)
+        if cached is not None:
+            return cached
+
+        prompt = self._construct_prompt(objective, history, dom, plan_k=k, dom_delta=dom_delta,
+                                        history_json=history_json)
+
+        logger.debug("Gemini prompt:\n%s", prompt)
+
+        try:
+            response = await self._agenerate_with_retry(prompt)
+            return self._parse_plan_response(response, k, cache_key)
+        except ValueError as e:
+            logger.error("Error decoding JSON from Gemini response: %s", e)
+            logger.error("Raw response was: %s",
+                         response.text if 'response' in locals() and hasattr(response, 'text') else 'N/A')
+            return [{"action": "fail", "reasoning": f"Invalid JSON response from AI: {e}"}]
+        except Exception as e:
+            logger.error("Error calling Gemini API: %s", e)
+            return [{"action": "fail", "reasoning": f"API call failed: {e}"}]
+
+    def _cached_plan(self, cache_key: bytes | None) -> list[dict] | None:
+        """Looks up a plan in the LRU, returning copies; None on miss."""
+        if cache_key is None:
+            return None
+        cached = self._action_cache.get(cache_key)
+        if cached is None:
+            return None
+        self._action_cache.move_to_end(cache_key)
+        logger.info("Gemini action cache hit; skipping API call (%d actions).", len(cached))
+        return [dict(action) for action in cached]
+
+    def _parse_plan_response(self, response, k: int, cache_key: bytes | None) -> list[dict]:
+        """
+        Turns a model response into a validated plan of at most k actions,
+        storing it in the LRU on success. Raises ValueError on undecodable
+        JSON; blocked/empty/malformed responses become a "fail" action.
+        """
+        # Accessing .text directly as response_mime_type is application/json
+        logger.debug("Gemini raw response:\n%s", response.text)
+
+        if not response.parts:
+            # Handle cases where response might be blocked or empty
+            logger.warning("Gemini response has no parts or might be blocked.")
+            # You might want to inspect response.prompt_feedback here for safety ratings
+            if response.prompt_feedback:
+                logger.warning("Prompt feedback: %s", response.prompt_feedback)
+            return [{"action": "fail", "reasoning": "AI response was empty or blocked."}]
+
+        # Assuming the response is valid JSON as requested
+        action_data = self._decode_json_lenient(response.text)
+
+        # A single-step plan may come back as a bare object.
+        actions = action_data if isinstance(action_data, list) else [action_data]
+
+        if not self._is_valid_actions(actions):
+            logger.error("Malformed action list in Gemini response.")
+            return [{"action": "fail", "reasoning": "AI response missing 'action' field."}]
+
+        actions = actions[:k]
+        if cache_key is not None:
+            self._action_cache[cache_key] = [dict(action) for action in actions]
+            if len(self._action_cache) > self._action_cache_max:
+                self._action_cache.popitem(last=False)
+        return actions
+
+    # Soft-failure shapes seen despite the JSON response type: the payload
+    # wrapped in a ```json fence, or framed by explanatory prose.
+    _FENCE_RE = re.compile(r"^\s*```(?:json)?\s*(.*?)\s*```\s*$", re.S)
+    _JSON_BODY_RE = re.compile(r"\[.*\]|\{.*\}", re.S)
+
+    @classmethod
+    def _decode_json_lenient(cls, text: str):
+        """
+        Decodes a model response, salvaging fenced or prose-framed JSON
+        before giving up — a recovered response costs a regex pass, an
+        unrecovered one costs a whole wasted model round-trip. Re-raises
+        the original ValueError when nothing decodes.
+        """
+        try:
+            return jsonutil.loads(text)
+        except ValueError:
+            candidates = []
+            fenced = cls._FENCE_RE.match(text)
+            if fenced:
+                candidates.append(fenced.group(1))
+            body = cls._JSON_BODY_RE.search(text)
+            if body:
+                candidates.append(body.group(0))
+            for candidate in candidates:
+                try:
+                    data = jsonutil.loads(candidate)
+                except ValueError:
+                    continue
+                logger.warning("Recovered JSON payload from a noisy Gemini response.")
+                return data
+            raise
+
+    # Fields each action type cannot act without; "finish"/"fail" need
+    # nothing beyond the action itself.
+    _REQUIRED_BY_ACTION = {
+        "click": ("selector",),
+        "type": ("selector", "text"),
+        "select": ("selector", "value"),
+        "finish": (),
+        "fail": (),
+    }
+
+    @classmethod
+    def _is_valid_actions(cls, actions) -> bool:
+        """
+        Single-pass structural check of a decoded plan: a non-empty list of
+        dicts, each naming a known action and carrying that action's
+        required fields. Catching a click without a selector here costs
+        nothing; letting it through costs a browser round-trip and a retry
+        turn. The previous check only looked for the "action" key.
+        """
+        if not isinstance(actions, list) or not actions:
+            return False
+        for action in actions:
+            if not isinstance(action, dict):
+                return False
+            required = cls._REQUIRED_BY_ACTION.get(action.get("action"))
+            if required is None:
+                return False
+            if any(not action.get(field) for field in required):
+                return False
+        return True
+
+    def _generate_with_retry(self, prompt: str):
+        """
+        Calls the model, retrying transient failures (rate limits, server
+        errors, timeouts) with exponential backoff plus jitter. Only the last
+        failure propagates, where get_next_action_plan turns it into a "fail"
+        action; earlier blips cost a short sleep instead of the whole run.
+        """
+        for attempt in range(self.ai_retries):
+            self._rate_limit()
+            try:
+                return self.model.generate_content(
+                    prompt,
+                    generation_config=self.generation_config
+                )
+            except Exception as e:
+                if attempt == self.ai_retries - 1:
+                    raise
+                delay = min(self.ai_backoff_base * 2 ** attempt, self.ai_backoff_cap) + random.random() * 0.1
+                logger.warning("Gemini call failed (%s); retrying in %.1fs...", e, delay)
+                time.sleep(delay)
+
+    async def _agenerate_with_retry(self, prompt: str):
+        """
+        Async twin of _generate_with_retry: same backoff policy, but waits
+        (rate-limit slot included) happen via asyncio.sleep so other
+        coroutines — the browser above all — keep running during them.
+        """
+        for attempt in range(self.ai_retries):
+            wait = self._reserve_rate_slot()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            try:
+                return await self.model.generate_content_async(
+                    prompt,
+                    generation_config=self.generation_config
+                )
+            except Exception as e:
+                if attempt == self.ai_retries - 1:
+                    raise
+                delay = min(self.ai_backoff_base * 2 ** attempt, self.ai_backoff_cap) + random.random() * 0.1
+                logger.warning("Gemini call failed (%s); retrying in %.1fs...", e, delay)
+                await asyncio.sleep(delay)
+
+    # Attributes worth showing the model, in display order.
+    _PROMPT_ATTRS = ("id", "name", "aria-label", "placeholder", "role", "type", "href", "data-testid")
+
+    @classmethod
+    def _element_line(cls, el: DOMElement) -> str:
+        """
+        One element as a single prompt line: tag, derived selector (when
+        one exists), quoted text, then attr=value pairs. Several times
+        fewer tokens than the JSON object form with the same content.
+        """
+        parts = [el.tag]
+        if el.selector:
+            parts.append(el.selector)
+        text = el.text_content[:100]
+        if text:
+            parts.append(jsonutil.dumps(text))
+        attributes = el.attributes
+        parts.extend(f"{attr}={attributes[attr][:80]}" for attr in cls._PROMPT_ATTRS if attributes.get(attr))
+        if el.options:
+            parts.append(f"options={jsonutil.dumps(el.options)}")
+        return " ".join(parts)
+
+    def _construct_prompt(self, objective: str, history: list[dict], dom: list[DOMElement], plan_k: int = 1,
+                          dom_delta: dict | None = None, history_json: str | None = None) -> str:
+        """
+        Constructs the detailed prompt for the Gemini model.
+        """
+        # Prune DOM to reduce token count if necessary, prioritize elements with clearer selectors or more info
+        # A more sophisticated approach might involve summarizing or filtering the DOM further.
+
+        # When the page barely changed since the last observation, describe the
+        # unchanged elements as one-line stubs and spend full detail only on
+        # what is new or different — most of the prompt bytes are attribute
+        # dicts, so a stable page shrinks the DOM section several-fold.
+        use_delta = (
+            dom_delta is not None
+            and len(dom_delta["added"]) + len(dom_delta["changed"]) < len(dom) / 2
+        )
+        if use_delta:
+            full_detail = dom_delta["added"] + dom_delta["changed"]
+            sections = ["New or changed elements:"]
+            if full_detail:
+                sections.extend(self._element_line(el) for el in full_detail)
+            else:
+                sections.append("(none)")
+            sections.append("Unchanged elements (abbreviated):")
+            sections.extend(
+                f"{el.tag} {el.selector or ''} {jsonutil.dumps(el.text_content[:40])}".rstrip()
+                for el in dom_delta["unchanged"]
+            )
+            if dom_delta["removed"]:
+                sections.append("Removed selectors: " + ", ".join(dom_delta["removed"]))
+            dom_section = "\n".join(sections)
+            dom_heading = ("Current Simplified DOM (interactive elements only), one element per line, "
+                           "as a delta against the previous observation. Unchanged elements are "
+                           "abbreviated but still present on the page and valid action targets:")
+        else:
+            # Identity-based key: valid only while the caller keeps passing
+            # the same snapshot list, which is exactly the lifetime a
+            # repeated render would cover. Element identity guards against
+            # a recycled list id.
+            dom_key = (id(dom), len(dom), id(dom[0]) if dom else 0)
+            if dom_key == self._dom_lines_key:
+                dom_section = self._dom_lines
+            else:
+                dom_section = "\n".join(self._element_line(el) for el in dom)
+                self._dom_lines_key, self._dom_lines = dom_key, dom_section
+            dom_heading = ("Current Simplified DOM (interactive elements only), one element per line as "
+                           "tag, selector, \"text\", attr=value pairs:")
+
+        prefix = self._prompt_cache.get(objective)
+        if prefix is None:
+            prefix = self._prompt_cache[objective] = f"""You are an AI agent controlling a web browser to achieve a specific objective.
+Your task is to decide the next action to take based on the current state of the webpage and the history of actions taken so far.
+
+Objective: {objective}
+
+"""
+        tail = _prompt_tail(plan_k)
+
+        history_section = (history_json if history_json is not None
+                           else self._serialize_history(history))
+        prompt = (
+            f"{prefix}{dom_heading}\n{dom_section}\n\n"
+            "History of actions taken so far (most recent last; callers window long histories before passing them in):\n"
+            f"{history_section}\n"
+            f"{tail}"
+        )
         return prompt
 
 if __name__ == '__main__':
@@ -175,9 +569,9 @@ if __name__ == '__main__':
                 {"action": "click", "selector": "a[href='/about']", "reasoning": "Navigating to about page", "status": "success"}
             ]
             mock_dom = [
-                {"tag": "a", "selector": "#contact-link", "attributes": {"id": "contact-link", "href": "/contact"}, "text_content": "Contact Us", "is_visible": True, "is_enabled": True},
-                {"tag": "input", "selector": "input[name='search']", "attributes": {"name": "search", "type": "search"}, "text_content": "", "is_visible": True, "is_enabled": True},
-                {"tag": "button", "text_content": "Submit", "is_visible": True, "is_enabled": True, "attributes": {}}
+                DOMElement(tag="a", selector="#contact-link", id="contact-link", href="/contact", text_content="Contact Us", is_visible=True, is_enabled=True),
+                DOMElement(tag="input", selector="input[name='search']", name="search", type="search", is_visible=True, is_enabled=True),
+                DOMElement(tag="button", text_content="Submit", is_visible=True, is_enabled=True),
             ]
 
             next_action = provider.get_next_action(mock_objective, mock_history, mock_dom)
@@ -187,9 +581,9 @@ if __name__ == '__main__':
             # Test a "finish" scenario (conceptually)
             mock_objective_finish = "You are on the login page. The user wants to log in."
             mock_dom_login = [
-                 {"tag": "input", "selector": "input[name='username']", "attributes": {"name": "username"}, "text_content": "", "is_visible": True, "is_enabled": True},
-                 {"tag": "input", "selector": "input[name='password']", "attributes": {"name": "password", "type": "password"}, "text_content": "", "is_visible": True, "is_enabled": True},
-                 {"tag": "button", "selector": "button[type='submit']", "attributes": {"type": "submit"}, "text_content": "Log In", "is_visible": True, "is_enabled": True}
+                 DOMElement(tag="input", selector="input[name='username']", name="username", is_visible=True, is_enabled=True),
+                 DOMElement(tag="input", selector="input[name='password']", name="password", type="password", is_visible=True, is_enabled=True),
+                 DOMElement(tag="button", selector="button[type='submit']", type="submit", text_content="Log In", is_visible=True, is_enabled=True),
             ]
             mock_history_login_attempt = [
                 {"action": "type", "selector": "input[name='username']", "text": "testuser", "status": "success"},
@@ -200,8 +594,8 @@ if __name__ == '__main__':
             # And the DOM shows dashboard elements
             mock_objective_dashboard = "Successfully logged in and view dashboard"
             mock_dom_dashboard = [
-                {"tag": "h1", "text_content": "Welcome to your Dashboard!", "is_visible": True, "is_enabled": True, "attributes":{}},
-                {"tag": "a", "selector": "a[href='/logout']", "attributes": {"href": "/logout"}, "text_content": "Logout", "is_visible": True, "is_enabled": True}
+                DOMElement(tag="h1", text_content="Welcome to your Dashboard!", is_visible=True, is_enabled=True),
+                DOMElement(tag="a", selector="a[href='/logout']", href="/logout", text_content="Logout", is_visible=True, is_enabled=True),
             ]
 
             print("\\nTesting 'finish' scenario conceptually:")
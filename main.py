@@ -1,43 +1,143 @@
+import asyncio
 import os
-import json
 import datetime
-from agent.orchestrator import Orchestrator
-from agent.providers.gemini import GeminiProvider
-from dotenv import load_dotenv
+import pathlib
+import sys
+from agent import jsonutil
+from dotenv import dotenv_values
+
+# Project-relative paths, resolved once at import instead of re-deriving
+# dirname(__file__) at every use site.
+BASE_DIR = pathlib.Path(__file__).resolve().parent
+CONFIG_DIR = BASE_DIR / 'config'
+DOTENV_PATH = CONFIG_DIR / '.env'
+OBJECTIVES_PATH = CONFIG_DIR / 'objectives.json'
+REPORTS_DIR = BASE_DIR / 'reports'
+
+# --- Configuration for the test ---
+# Test Objective: Log in to a test website.
+# This example uses https://practicetestautomation.com/practice-test-login/
+# Objective: "Log in to the website using username 'student' and password 'Password123', then verify successful login by finding the 'Log out' button."
+# Start URL: "https://practicetestautomation.com/practice-test-login/"
+#
+# Default (objective, start_url) pairs to run, used when no
+# config/objectives.json is present. A single entry behaves exactly as
+# before; several entries run concurrently through Orchestrator.run_many,
+# overlapping their Gemini and browser latency.
+TASKS = [
+    ("คลิก 'login to g-track' และกรอกข้อมูล username 'vowner2@example.com' และ password '5KyB1TYoOY09' ให้ถูกต้อง จากนั้นกดปุ่ม login เพื่อเข้าสู่ระบบ จาก นั้นให้กด ที่ 'คนชับ' แล้วรอ จนตารางโหลดเสร็จ แล้วคลิก 'แก้ไข' เพื่อแก้ไขข้อมูลของคนขับ(อยู่ในตาราง) ชื่อ 'ณรงค์ คนขับซี' เปลี่ยน email จาก 'driver3@example.com' เป็น 'driver3@example.co.th'",
+     "https://www.g-tracking.com/"),
+]
+
+# Upper bound on concurrently open browser contexts / in-flight Gemini
+# calls when TASKS holds more than one entry.
+MAX_CONCURRENCY = 3
+
+# .env is parsed at most once per process; repeated main() calls (REPL,
+# notebook) skip the file read and tokenize pass.
+_env_loaded = False
+
+def _load_env(dotenv_path) -> str | None:
+    """
+    Loads config/.env into os.environ (first call only, never overriding
+    variables already set) and returns the Google API key.
+    """
+    global _env_loaded
+    if not _env_loaded:
+        for key, value in dotenv_values(dotenv_path).items():
+            if value is not None and key not in os.environ:
+                os.environ[key] = value
+        _env_loaded = True
+    return os.environ.get("GOOGLE_API_KEY")
+
+def _load_tasks():
+    """
+    Returns the (objective, start_url) pairs to run. When
+    config/objectives.json exists — a JSON array of {"objective": ...,
+    "start_url": ...} objects — it overrides the in-source TASKS default,
+    so batches can be edited without touching source.
+    """
+    try:
+        with open(OBJECTIVES_PATH, 'rb') as f:
+            entries = jsonutil.loads(f.read())
+        tasks = [(entry["objective"], entry["start_url"]) for entry in entries]
+        if not tasks:
+            print(f"Ignoring empty {OBJECTIVES_PATH}: no tasks defined.")
+            return TASKS
+        return tasks
+    except FileNotFoundError:
+        return TASKS
+    except (OSError, ValueError, KeyError, TypeError) as e:
+        print(f"Ignoring malformed {OBJECTIVES_PATH}: {e}")
+        return TASKS
+
+# Per-record report lines in display order: (label, record key, always).
+# Fields marked always print even when missing (with an N/A placeholder);
+# the rest are skipped when empty.
+_HISTORY_FIELDS = (
+    ("Selector", "selector", False),
+    ("Text", "text", False),
+    ("Value", "value", False),
+    ("URL", "url", False),
+    ("Reasoning", "reasoning", True),
+    ("Status", "status", True),
+    ("Error", "error_message", False),
+)
+
+def _print_history(history):
+    # Build the whole history block in memory and emit it with one write
+    # instead of half a dozen print calls (each a write syscall) per record.
+    buf = ["\\n--- Action History ---\n"]
+    for i, record in enumerate(history):
+        buf.append(f"{i+1}. Action: {record.get('action')}\n")
+        for label, key, always in _HISTORY_FIELDS:
+            value = record.get(key)
+            if value:
+                buf.append(f"   {label}: {value}\n")
+            elif always:
+                buf.append(f"   {label}: N/A\n")
+        buf.append("-" * 20 + "\n")
+    sys.stdout.write("".join(buf))
 
 def main():
     # Ensure config/.env exists and is loaded for API keys
     # The GeminiProvider and BrowserController might need it.
     # Load from project root's perspective for main.py
-    dotenv_path = os.path.join(os.path.dirname(__file__), 'config', '.env')
-    if not os.path.exists(dotenv_path):
-        print(f"Warning: {dotenv_path} not found. API keys might not be available.")
+    # Exclusive-create probes and claims the path in one syscall: the
+    # common file-exists startup costs a single failed open instead of a
+    # stat, a makedirs walk and an unconditional re-open.
+    try:
+        try:
+            template = open(DOTENV_PATH, 'x')
+        except FileNotFoundError:
+            os.makedirs(CONFIG_DIR, exist_ok=True)
+            template = open(DOTENV_PATH, 'x')
+    except FileExistsError:
+        pass
+    else:
+        print(f"Warning: {DOTENV_PATH} not found. API keys might not be available.")
         print("Please create a config/.env file with your GOOGLE_API_KEY.")
         # Create a dummy one if it doesn't exist so GeminiProvider doesn't fail on import
         # though it will fail on actual use if key is dummy.
-        os.makedirs(os.path.join(os.path.dirname(__file__), 'config'), exist_ok=True)
-        with open(dotenv_path, 'w') as f:
-            f.write('GOOGLE_API_KEY="YOUR_GOOGLE_API_KEY_HERE"\n')
-            f.write('OPENAI_API_KEY="YOUR_OPENAI_API_KEY_HERE"\n')
-        print(f"Created a template {dotenv_path}. Please fill in your API keys.")
+        with template as f:
+            f.write('GOOGLE_API_KEY="YOUR_GOOGLE_API_KEY_HERE"\n'
+                    'OPENAI_API_KEY="YOUR_OPENAI_API_KEY_HERE"\n')
+        print(f"Created a template {DOTENV_PATH}. Please fill in your API keys.")
         return # Exit if no real .env, as it won't work
 
-    load_dotenv(dotenv_path=dotenv_path)
+    google_key = _load_env(DOTENV_PATH)
 
-    if not os.getenv("GOOGLE_API_KEY") or os.getenv("GOOGLE_API_KEY") == "YOUR_GOOGLE_API_KEY_HERE":
+    if not google_key or google_key == "YOUR_GOOGLE_API_KEY_HERE":
         print("Error: GOOGLE_API_KEY is not set or is still the placeholder in config/.env.")
         print("Please update config/.env with your actual Google API Key.")
         return
 
-    # --- Configuration for the test ---
-    # Test Objective: Log in to a test website.
-    # This example uses https://practicetestautomation.com/practice-test-login/
-    # Objective: "Log in to the website using username 'student' and password 'Password123', then verify successful login by finding the 'Log out' button."
-    # Start URL: "https://practicetestautomation.com/practice-test-login/"
-
-    # Test Objective: Search on Google
-    objective = "คลิก 'login to g-track' และกรอกข้อมูล username 'vowner2@example.com' และ password '5KyB1TYoOY09' ให้ถูกต้อง จากนั้นกดปุ่ม login เพื่อเข้าสู่ระบบ จาก นั้นให้กด ที่ 'คนชับ' แล้วรอ จนตารางโหลดเสร็จ แล้วคลิก 'แก้ไข' เพื่อแก้ไขข้อมูลของคนขับ(อยู่ในตาราง) ชื่อ 'ณรงค์ คนขับซี' เปลี่ยน email จาก 'driver3@example.com' เป็น 'driver3@example.co.th'"
-    start_url = "https://www.g-tracking.com/"
+    # Imported only after the env checks pass: agent.orchestrator pulls in
+    # playwright and agent.providers.gemini pulls in google-generativeai,
+    # both heavyweight imports the early-exit paths above never need.
+    from agent.browser.controller import BrowserController
+    from agent.orchestrator import Orchestrator
+    from agent.providers.gemini import GeminiProvider
 
     # --- Initialize components ---
     try:
@@ -52,13 +152,92 @@ def main():
         return
 
     print("Initializing Orchestrator...")
-    agent_orchestrator = Orchestrator(provider=gemini_brain, max_attempts=10)
+    # Single-run CLI: no later run will reuse the context, so tear it down.
+    agent_orchestrator = Orchestrator(provider=gemini_brain, max_attempts=10, persistent=False)
+
+    tasks = _load_tasks()
+    os.makedirs(REPORTS_DIR, exist_ok=True)
+    timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+
+    if len(tasks) > 1:
+        # --- Run the batch concurrently ---
+        print(f"Starting {len(tasks)} tests (concurrency {MAX_CONCURRENCY})...")
+
+        async def _run_batch():
+            # The shared Chromium process and Playwright driver outlive the
+            # per-task contexts; close them inside the loop that launched
+            # them, before asyncio.run tears the loop down.
+            try:
+                return await agent_orchestrator.run_many(tasks, concurrency=MAX_CONCURRENCY)
+            finally:
+                await BrowserController.shutdown_all()
+
+        results = asyncio.run(_run_batch())
+        for index, ((objective, start_url), result) in enumerate(zip(tasks, results), start=1):
+            print(f"\\n--- Task {index}/{len(tasks)}: \"{objective}\" ---")
+            if isinstance(result, BaseException):
+                print(f"Task raised: {result}")
+                continue
+            success, history = result
+            print("Objective: ACHIEVED" if success else "Objective: FAILED or max attempts reached")
+            _print_history(history)
+            report_file = REPORTS_DIR / f"test_report_{timestamp}_{index}.json"
+            try:
+                payload = jsonutil.dumps({"objective": objective, "start_url": start_url,
+                                          "success": success, "history": history}, indent=True)
+                # Binary mode with a large buffer: the pre-encoded payload
+                # goes to the kernel in one write, skipping the text-layer
+                # encoder and its 8 KiB flushes.
+                with open(report_file, 'wb', buffering=1 << 20) as f:
+                    f.write(payload.encode('utf-8'))
+                print(f"Test report saved to: {report_file}")
+            except Exception as e:
+                print(f"Error saving report: {e}")
+        return
+
+    objective, start_url = tasks[0]
 
     # --- Run the test ---
     print(f"Starting test with objective: \"{objective}\"")
     print(f"Start URL: {start_url}")
 
-    success, history = agent_orchestrator.run_test(objective, start_url)
+    # The report is streamed while the test runs: the file is opened up
+    # front and each history record is appended as it is produced, so a
+    # crashed run still leaves its records on disk and the history is
+    # never serialized a second time at the end.
+    report_file = REPORTS_DIR / f"test_report_{timestamp}.json"
+    report = None
+    record_sink = None
+    first_record = True
+    try:
+        # Binary mode with a 1 MiB buffer so the small per-record writes
+        # coalesce in userspace instead of trickling through the text
+        # layer's encoder and default 8 KiB buffer.
+        report = open(report_file, 'wb', buffering=1 << 20)
+        report.write(('{"objective": ' + jsonutil.dumps(objective)
+                      + ', "start_url": ' + jsonutil.dumps(start_url)
+                      + ', "history": [').encode('utf-8'))
+
+        def record_sink(record):
+            nonlocal first_record
+            report.write((("" if first_record else ",\n") + jsonutil.dumps(record)).encode('utf-8'))
+            # Records arrive at most once per browser action, so flushing
+            # each one costs nothing — and without it a killed run leaves
+            # everything sitting in the 1 MiB buffer.
+            report.flush()
+            first_record = False
+    except OSError as e:
+        print(f"Error opening report file: {e}")
+
+    async def _run_single():
+        # Same teardown as the batch path: the shared browser must close in
+        # the loop that launched it.
+        try:
+            return await agent_orchestrator.run_test(objective, start_url, record_sink=record_sink)
+        finally:
+            await BrowserController.shutdown_all()
+
+    success, history = asyncio.run(_run_single())
 
     # --- Report results ---
     print("\\n--- Test Run Complete ---")
@@ -67,34 +246,16 @@ def main():
     else:
         print("Objective: FAILED or max attempts reached")
 
-    print("\\n--- Action History ---")
-    for i, record in enumerate(history):
-        print(f"{i+1}. Action: {record.get('action')}")
-        if record.get('selector'):
-            print(f"   Selector: {record.get('selector')}")
-        if record.get('text'):
-            print(f"   Text: {record.get('text')}")
-        if record.get('value'):
-            print(f"   Value: {record.get('value')}")
-        if record.get('url'):
-            print(f"   URL: {record.get('url')}")
-        print(f"   Reasoning: {record.get('reasoning', 'N/A')}")
-        print(f"   Status: {record.get('status')}")
-        if record.get('error_message'):
-            print(f"   Error: {record.get('error_message')}")
-        print("-" * 20)
-
-    # Save history to a report file
-    reports_dir = os.path.join(os.path.dirname(__file__), 'reports')
-    os.makedirs(reports_dir, exist_ok=True)
-    timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-    report_file = os.path.join(reports_dir, f"test_report_{timestamp}.json")
-    try:
-        with open(report_file, 'w') as f:
-            json.dump({"objective": objective, "start_url": start_url, "success": success, "history": history}, f, indent=2)
-        print(f"Test report saved to: {report_file}")
-    except Exception as e:
-        print(f"Error saving report: {e}")
+    _print_history(history)
+
+    # Close out the streamed report with the run verdict.
+    if report is not None:
+        try:
+            report.write(b'], "success": ' + (b'true' if success else b'false') + b'}')
+            report.close()
+            print(f"Test report saved to: {report_file}")
+        except Exception as e:
+            print(f"Error saving report: {e}")
 
 
 if __name__ == "__main__":